@@ -1,16 +1,26 @@
+import hashlib
 import json
 import os
+import re
 import sys
+import time
 import warnings
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from functools import cache, wraps
 from pathlib import Path
 
 import click
-import gsw
 import numpy as np
 import pandas as pd
 import sentry_sdk
 from dotenv import load_dotenv
-from hakai_api import Client
 from ioos_qc.config import Config
 from ioos_qc.stores import PandasStore
 from ioos_qc.streams import PandasStream
@@ -20,29 +30,30 @@ from sentry_sdk.integrations.logging import LoggingIntegration
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
-from hakai_ctd_qc import hakai_tests, sentry_warnings, variables
+from hakai_ctd_qc import (
+    async_io,
+    hakai_tests,
+    qartod_batch,
+    sentry_warnings,
+    teos10,
+    variables,
+)
+from hakai_ctd_qc.cache import DEFAULT_RESPONSE_CACHE_DIR, ResultCache
+from hakai_ctd_qc.chunking import AdaptiveChunker
+from hakai_ctd_qc.context import QARTOD_ENGINES, QCContext, get_context, set_context
+from hakai_ctd_qc.flags import FlagMatrix
 from hakai_ctd_qc.hakai_tests import qartod_to_hakai_flag
-from hakai_ctd_qc.utils import retry
+from hakai_ctd_qc.journal import DEFAULT_JOURNAL_PATH, Journal, hash_items
+from hakai_ctd_qc.qc_config import QartodConfig
+from hakai_ctd_qc.utils import async_retry
 from hakai_ctd_qc.variables import manual_qc_variables
 from hakai_ctd_qc.version import __version__
 
-load_dotenv(".env", override=True)
-
-
-if os.getenv("IGNORE_WARNINGS") not in ("False", "0", "false", "", None):
-    logger.info("Ignore Future and Deprecation Warnings")
-    warnings.filterwarnings("ignore", category=FutureWarning)
-    warnings.filterwarnings("ignore", category=DeprecationWarning)
-
-logger.debug("Hakai Profile QC version: {}", __version__)
-
 hakai_to_qartod_flag = {v: k for k, v in qartod_to_hakai_flag.items()}
 
-QARTOD_DTYPE = pd.CategoricalDtype([9, 2, 1, 3, 4], ordered=True)
-
 
 def check_hakai_database_rebuild(api_root):
-    response = client.get(f"{api_root}/api/rebuild_status")
+    response = get_context().client.get(f"{api_root}/api/rebuild_status")
     is_running_rebuilding = response.json()[0]["rebuild_running"]
     if is_running_rebuilding:
         logger.warning(
@@ -97,29 +108,10 @@ def run_profiling(output):
     atexit.register(exit)
 
 
-tqdm.pandas()
 PACKAGE_PATH = Path(__file__).parent
 DEFAULT_CONFIG_PATH = PACKAGE_PATH / ".." / "default-config.yaml"
 ENV_CONFIG_PATH = PACKAGE_PATH / ".." / "config.yaml"
 
-# Set logger
-# logger.remove() # do not remove logger in the hopes that this will log to stdout and docker logs again
-logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
-LOG_FILE = os.environ.get("LOG_FILE")
-if LOG_FILE:
-    logger.info("Log to file: {}", LOG_FILE)
-    logger.add(LOG_FILE, rotation="1 week", retention="1 month")
-
-HAKAI_TESTS_CONFIGURATION = json.loads(
-    (PACKAGE_PATH / "config" / "hakai_ctd_profile_tests_config.json").read_text()
-)
-QARTOD_TESTS_CONFIGURATION = json.loads(
-    (PACKAGE_PATH / "config" / "hakai_ctd_profile_qartod_test_config.json").read_text()
-)
-HAKAI_GREY_LIST = hakai_tests.load_grey_list(
-    PACKAGE_PATH / "HakaiProfileDatasetGreyList.csv"
-)
-
 ioos_qc_coords_mapping = {
     "tinp": "measurement_dt",
     "zinp": "depth",
@@ -128,31 +120,31 @@ ioos_qc_coords_mapping = {
 }
 
 
-log_to_sentry()
-logger.info("Start Process")
-if "HAKAI_API_TOKEN" in os.environ:
-    logger.info(
-        "HAKAI_API_TOKEN as env variable: {}", len(os.environ["HAKAI_API_TOKEN"])
-    )
-client = Client(credentials=os.environ.get("HAKAI_API_TOKEN"))
-
-
-def get_hakai_station_list():
-    """get_hakai_station_list
-        Retrieve station list available within the Hakai production database.
+@cache
+def setup():
+    """Load the .env file, set the log sinks and initialize sentry.
 
-    Returns:
-        dataframe: full dataframe list of stations and
-            associated depth, latitude, and longitude
+    Called once by the command line interface and the api before running
+    the qc, importing the package has no side effect.
     """
-    return pd.DataFrame(
-        client.get(
-            "https://hecate.hakai.org/api/eims/views/output/sites?limit=-1"
-        ).json()
-    ).rename(columns={"name": "station", "depth": "station_depth"})
+    load_dotenv(".env", override=True)
+
+    if os.getenv("IGNORE_WARNINGS") not in ("False", "0", "false", "", None):
+        logger.info("Ignore Future and Deprecation Warnings")
+        warnings.filterwarnings("ignore", category=FutureWarning)
+        warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+    # Set logger
+    # logger.remove() # do not remove logger in the hopes that this will log to stdout and docker logs again
+    logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
+    log_file = os.environ.get("LOG_FILE")
+    if log_file:
+        logger.info("Log to file: {}", log_file)
+        logger.add(log_file, rotation="1 week", retention="1 month")
 
-hakai_stations = get_hakai_station_list()
+    logger.debug("Hakai Profile QC version: {}", __version__)
+    log_to_sentry()
+    logger.info("Start Process")
 
 
 def _run_ioosqc_on_dataframe(df, qc_config, tinp="t", zinp="z", lat="lat", lon="lon"):
@@ -169,7 +161,7 @@ def _run_ioosqc_on_dataframe(df, qc_config, tinp="t", zinp="z", lat="lat", lon="
     # Set Stream
     stream = PandasStream(df, time=tinp, z=zinp, lat=lat, lon=lon)
     # Set Configuration
-    c = Config(qc_config)
+    c = qc_config if isinstance(qc_config, Config) else Config(qc_config)
 
     # Run
     results = stream.run(c)
@@ -180,61 +172,115 @@ def _run_ioosqc_on_dataframe(df, qc_config, tinp="t", zinp="z", lat="lat", lon="
     return df.join(result_store).set_index(original_index)
 
 
-def _generate_process_flags_json(cast, data):
-    """
-    Generate a JSON representation of the qced data compatible the
-    hakai_api endpoint "{api_root}/ctd/process/flags/json/{row['ctd_cast_pk']}"
-    """
-    return json.dumps(
-        {
-            "cast": json.loads(
-                cast[
-                    ["ctd_cast_pk", "hakai_id", "processing_stage", "process_error"]
-                ].to_json()
-            ),
-            "ctd_data": json.loads(
-                data.query(f"hakai_id=='{cast['hakai_id']}'")
-                .filter(regex="^ctd_data_pk$|_flag$|_flag_level_1$")
-                .drop(
-                    columns=[
-                        "direction_flag",
-                        "process_flag",
-                        "process_flag_level_1",
-                        "location_flag",
-                        "location_flag_level_1",
-                    ]
-                )
-                .to_json(orient="records")
-            ),
-        }
+def _run_qartod_tests(
+    df, qc_config: QartodConfig, by, engine="ioos_qc", desc="", unit="it"
+):
+    """Run the QARTOD tests on each group of records defined by the `by` columns
+    with either ioos_qc (one PandasStream per group) or the batch engine (all
+    groups at once)."""
+    if engine not in QARTOD_ENGINES:
+        raise ValueError(
+            f"Unknown qartod engine {engine}, must be one of {QARTOD_ENGINES}"
+        )
+    if engine == "batch":
+        if qartod_batch.is_supported(qc_config.tests):
+            return qartod_batch.run_qartod_tests(
+                df, qc_config.tests, by, **ioos_qc_coords_mapping
+            )
+        logger.warning("QARTOD configuration not supported in batch, run ioos_qc")
+
+    # Only run ioos_qc on the streams recorded within each group, the flags of
+    # the streams without any value are then generated for all groups at once
+    unrecorded = qartod_batch.unrecorded_streams(df, qc_config.tests, by)
+    configs = {
+        streams: qc_config.drop_streams(streams).ioos_config
+        for streams in set(unrecorded.values())
+    }
+    tqdm.pandas(desc=desc, unit=unit)
+    df = df.groupby(by, as_index=False, group_keys=True).progress_apply(
+        lambda x: _run_ioosqc_on_dataframe(
+            x, configs[unrecorded[x.name]], **ioos_qc_coords_mapping
+        ),
+    )
+    return qartod_batch.fill_unrecorded_streams(
+        df, qc_config.tests, by, unrecorded, **ioos_qc_coords_mapping
     )
 
 
-def _derived_ocean_variables(df):
-    """Compute Derived Variables with TEOS-10 equations"""
+PROCESS_FLAGS_CAST_VARIABLES = [
+    "ctd_cast_pk",
+    "hakai_id",
+    "processing_stage",
+    "process_error",
+]
+PROCESS_FLAGS_DATA_VARIABLES_REGEX = re.compile("^ctd_data_pk$|_flag$|_flag_level_1$")
+PROCESS_FLAGS_EXCLUDED_VARIABLES = [
+    "direction_flag",
+    "process_flag",
+    "process_flag_level_1",
+    "location_flag",
+    "location_flag_level_1",
+]
 
-    def _drop_sbe_flag(x):
-        return x.replace({-9.99e-29: np.nan})
 
-    longitude = df["station_longitude"].fillna(df["longitude"])
-    latitude = df["station_latitude"].fillna(df["latitude"])
-    df["absolute salinity"] = gsw.SA_from_SP(
-        _drop_sbe_flag(df["salinity"]),
-        _drop_sbe_flag(df["pressure"]),
-        longitude,
-        latitude,
-    )
-    df["conservative temperature"] = gsw.CT_from_t(
-        df["absolute salinity"],
-        _drop_sbe_flag(df["temperature"]),
-        df["pressure"],
+def _json_values(series):
+    """Convert a series to a list of json serializable python values"""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def _generate_process_flags_json(casts, data):
+    """
+    Generate a JSON representation of the qced data of each cast compatible the
+    hakai_api endpoint "{api_root}/ctd/process/flags/json/{row['ctd_cast_pk']}"
+
+    The data is partitioned by hakai_id and the flag columns are converted once
+    for the whole chunk, each cast payload is then encoded from its own slice.
+
+    Returns:
+        dict: {hakai_id: json string}
+    """
+    flag_columns = [
+        column
+        for column in data.columns
+        if PROCESS_FLAGS_DATA_VARIABLES_REGEX.search(column)
+        and column not in PROCESS_FLAGS_EXCLUDED_VARIABLES
+    ]
+
+    # Sort records by hakai_id while retaining their original order within each cast
+    codes, hakai_ids = pd.factorize(data["hakai_id"])
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(hakai_ids) + 1))
+    records = list(
+        zip(*[_json_values(data[column].iloc[order]) for column in flag_columns])
     )
-    df["density"] = gsw.rho(
-        df["absolute salinity"],
-        df["conservative temperature"],
-        _drop_sbe_flag(df["pressure"]),
+    cast_records = {
+        hakai_id: records[start:end]
+        for hakai_id, start, end in zip(hakai_ids, bounds[:-1], bounds[1:])
+    }
+
+    casts_values = zip(
+        *[_json_values(casts[column]) for column in PROCESS_FLAGS_CAST_VARIABLES]
     )
-    df["sigma0"] = gsw.sigma0(df["absolute salinity"], df["conservative temperature"])
+    return {
+        cast["hakai_id"]: json.dumps(
+            {
+                "cast": cast,
+                "ctd_data": [
+                    dict(zip(flag_columns, record))
+                    for record in cast_records.get(cast["hakai_id"], [])
+                ],
+            }
+        )
+        for cast in (
+            dict(zip(PROCESS_FLAGS_CAST_VARIABLES, values)) for values in casts_values
+        )
+    }
+
+
+def _derived_ocean_variables(df, threads=None):
+    """Compute Derived Variables with TEOS-10 equations"""
+    for variable, values in teos10.derived_ocean_variables(df, threads=threads).items():
+        df[variable] = values
     return df
 
 
@@ -245,74 +291,168 @@ def _convert_time_to_datetime(df):
     return df
 
 
+def _qc_configuration_hash(context: QCContext):
+    """Hash identifying the qc configuration and version applied"""
+    return hash_items(
+        __version__,
+        context.qartod_config,
+        context.hakai_tests_config,
+        context.grey_list.to_dict(orient="records"),
+    )
+
+
+def _casts_fingerprint(df, metadata, context: QCContext):
+    """Generate a fingerprint of each cast inputs to the qc.
+
+    The fingerprint combines the cast raw data and manual flags, the cast
+    metadata (cast_type, process_log), the station depth, the grey list
+    entries matching the cast instruments, the qc configurations, the QARTOD
+    engine and the package version.
+
+    Returns:
+        dict: {hakai_id: fingerprint}
+    """
+    configuration = hash_items(
+        __version__,
+        context.qartod_engine,
+        context.qartod_config,
+        context.hakai_tests_config,
+    )
+    columns = sorted(
+        col
+        for col in df.columns
+        if col in variables.CTD_CAST_DATA_VARIABLES or col.endswith("_manual_qc_flag")
+    )
+    if "ctd_data_pk" in df:
+        df = df.sort_values("ctd_data_pk")
+    rows_hash = pd.util.hash_pandas_object(df[columns], index=False).values
+    metadata = metadata.drop_duplicates("hakai_id").set_index("hakai_id")
+    metadata = metadata[
+        [col for col in ("cast_type", "process_log") if col in metadata]
+    ]
+    station_depth = context.stations.drop_duplicates("station").set_index("station")[
+        "station_depth"
+    ]
+    grey_list = context.grey_list.assign(
+        device=context.grey_list["device_model"] + context.grey_list["device_sn"]
+    )
+
+    fingerprints = {}
+    for hakai_id, rows in df.groupby("hakai_id").indices.items():
+        devices = (
+            df["device_model"].iloc[rows].astype(str)
+            + df["device_sn"].iloc[rows].astype(str)
+        ).unique()
+        fingerprints[hakai_id] = hash_items(
+            configuration,
+            hashlib.sha256(rows_hash[rows].tobytes()).hexdigest(),
+            (metadata.loc[hakai_id].to_dict() if hakai_id in metadata.index else None),
+            station_depth.get(df["station"].iloc[rows[0]]) if "station" in df else None,
+            grey_list.loc[grey_list["device"].isin(devices)]
+            .drop(columns="device")
+            .to_dict(orient="records"),
+        )
+    return fingerprints
+
+
+def _run_cached_qc_profiles(df, metadata, cache, context):
+    """Run the qc on the casts missing from the cache and retrieve the
+    results of the other casts from the cache."""
+    fingerprints = _casts_fingerprint(df, metadata, context)
+    cached = {}
+    for hakai_id, fingerprint in fingerprints.items():
+        result = cache.get(fingerprint)
+        if result is not None:
+            cached[hakai_id] = result
+    logger.info("Retrieve {} casts qc results from cache", len(cached))
+
+    df = df.loc[~df["hakai_id"].isin(list(cached))]
+    results = list(cached.values())
+    if not df.empty:
+        df_qced = run_qc_profiles(df, metadata, context=context)
+        for hakai_id, result in df_qced.groupby("hakai_id"):
+            cache.put(fingerprints[hakai_id], result)
+        results.insert(0, df_qced)
+    return pd.concat(results).reset_index(drop=True)
+
+
+def _journal_chunk(journal, chunk, result, upload_flag):
+    """Record in the journal the stage reached by each cast of a processed chunk"""
+    casts = chunk.set_index("hakai_id")["ctd_cast_pk"]
+    if result["stats"] is None:
+        # The chunk data couldn't be retrieved or qced
+        journal.record("failed", zip(casts.values, casts.index))
+        return
+    qced = casts.index.isin(list(result["stats"]["records_per_cast"]))
+    journal.record("fetched", zip(casts[~qced].values, casts.index[~qced]))
+    journal.record("qced", zip(casts[qced].values, casts.index[qced]))
+    if upload_flag:
+        uploaded = casts.loc[result["hakai_ids"]]
+        journal.record("uploaded", zip(uploaded.values, uploaded.index))
+
+
 def _cleanup():
     sentry_sdk.flush()
     sys.exit(1)
 
 
-def run_qc_profiles(df, metadata):
+def run_qc_profiles(df, metadata, cache=None, context: QCContext = None):
     """
     Main method that runs on a number of profiles a series of QARTOD tests and specific
     to the Hakai CTD Dataset.
+
+    The configurations, grey list and station list are retrieved from the given
+    context (default to get_context()). If a ResultCache is given, the casts with
+    unchanged inputs reuse the cached results of a previous run.
     """
+    context = context or get_context()
+    if cache is not None:
+        return _run_cached_qc_profiles(df, metadata, cache, context)
+
     # Read configurations
-    qartod_config = QARTOD_TESTS_CONFIGURATION
-    hakai_tests_config = HAKAI_TESTS_CONFIGURATION
+    qc_config = context.qc_config
+    hakai_tests_config = qc_config.hakai_tests
 
     # Regroup profiles by profile_id and direction and sort them along zinpQARTOD
     df = df.sort_values(by=["hakai_id", "direction_flag", "depth"])
 
-    # Retrieve tested variables list
-    tested_variable_list = []
-    for context in qartod_config["contexts"]:
-        for stream, _ in context["streams"].items():
-            if stream not in tested_variable_list:
-                tested_variable_list += [stream]
-
     # Find Flag values present in the data, attach a FAIL QARTOD Flag to them and replace them by NaN.
     #  Hakai database ingested some seabird flags -9.99E-29 which need to be recognized and removed.
+    # Replace all bad values by np.nan within the same scan
     if "bad_value_test" in hakai_tests_config:
         df = hakai_tests.bad_value_test(
             df,
             **hakai_tests_config["bad_value_test"],
+            drop_bad_values=True,
         )
-        # Replace all bad values by np.nan
-        df = df.replace({value: np.nan for value in [None, pd.NA, -9.99e-29]})
 
     # Run QARTOD tests
     # On profiles
-    tqdm.pandas(desc="Apply QARTOD Tests to individual profiles", unit=" profile")
-    df_profiles = (
-        df.query("direction_flag in ('d','u')")
-        .groupby(["hakai_id", "direction_flag"], as_index=False, group_keys=True)
-        .progress_apply(
-            lambda x: _run_ioosqc_on_dataframe(
-                x, qartod_config, **ioos_qc_coords_mapping
-            ),
-        )
+    df_profiles = _run_qartod_tests(
+        df.query("direction_flag in ('d','u')"),
+        qc_config.profile,
+        ["hakai_id", "direction_flag"],
+        engine=context.qartod_engine,
+        desc="Apply QARTOD Tests to individual profiles",
+        unit=" profile",
     )
-    # On static measurements
-    tqdm.pandas(
+    # On static measurements without the QARTOD tests that aren't compatible
+    # with static unique mesurements
+    # Each static measurement is its own group, always run the tests on all
+    # the static measurements at once with the batch engine
+    df_static = _run_qartod_tests(
+        df.query("direction_flag in ('s')"),
+        qc_config.static,
+        ["hakai_id", "measurement_dt"],
+        engine="batch",
         desc="Apply QARTOD Tests to individual static measurements",
         unit=" measurement",
     )
-    # Drop QARTOD tests that aren't compatible with static unique mesurements
-    static_qartod_config = qartod_config.copy()
-    for context in static_qartod_config["contexts"]:
-        for var, tests in context["streams"].items():
-            tests["qartod"].pop("attenuated_signal_test", None)
-    df_static = (
-        df.query("direction_flag in ('s')")
-        .groupby(["hakai_id", "measurement_dt"], as_index=False, group_keys=True)
-        .progress_apply(
-            lambda x: _run_ioosqc_on_dataframe(
-                x, qartod_config, **ioos_qc_coords_mapping
-            ),
-        )
-    )
 
     # Regroup back together profiles and static data
     df = pd.concat([df_profiles, df_static]).reset_index(drop=True)
+    # Order the records of each profile by depth once for all the hakai tests
+    profile_index = hakai_tests.ProfileIndex(df)
 
     # HAKAI SPECIFIC TESTS #
     # This section regroup different non QARTOD tests which are specific to
@@ -328,6 +468,7 @@ def run_qc_profiles(df, metadata):
                 df,
                 key,
                 **do_config,
+                profile_index=profile_index,
             )
 
     # BOTTOM HIT DETECTION
@@ -336,7 +477,9 @@ def run_qc_profiles(df, metadata):
     if "bottom_hit_detection" in hakai_tests_config:
         logger.debug("Flag Bottom Hit Data")
         df = hakai_tests.bottom_hit_detection(
-            df, **hakai_tests_config["bottom_hit_detection"]
+            df,
+            **hakai_tests_config["bottom_hit_detection"],
+            profile_index=profile_index,
         )
 
     # Detect PAR Shadow
@@ -345,12 +488,16 @@ def run_qc_profiles(df, metadata):
         df = hakai_tests.par_shadow_test(
             df,
             **hakai_tests_config["par_shadow_test"],
+            profile_index=profile_index,
         )
     # Station Maximum Depth Test
     if "depth_range_test" in hakai_tests_config:
         logger.debug("Review maximum depth per profile vs station")
         df = hakai_tests.hakai_station_maximum_depth_test(
-            df, hakai_stations, **hakai_tests_config["depth_range_test"]
+            df,
+            context.stations,
+            **hakai_tests_config["depth_range_test"],
+            profile_index=profile_index,
         )
     # Apply Query Based Flag
     if "query_based_flag" in hakai_tests_config:
@@ -363,48 +510,440 @@ def run_qc_profiles(df, metadata):
 
     # APPLY QARTOD FLAGS FROM ONE CHANNEL TO OTHER AGGREGATED ONES
     # Generate Hakai Flags
+    flag_matrix = FlagMatrix(df, qc_config.flag_columns)
     for var in tqdm(
-        tested_variable_list, desc="Aggregate flags for each variables", unit="var"
+        qc_config.tested_variables,
+        desc="Aggregate flags for each variables",
+        unit="var",
     ):
         logger.debug("Apply flag results to {}", var)
-        consirederd_flag_columns = "|".join(
-            hakai_tests_config["flag_aggregation"]["default"]
-            + hakai_tests_config["flag_aggregation"].get(var, [])
-            + [f"{var}_qartod_.*|{var}_hakai_.*|{var}_manual_qc_flag"]
-        )
-        df = _get_hakai_flag_columns(df, var, consirederd_flag_columns)
+        df = _get_hakai_flag_columns(df, var, flag_matrix=flag_matrix)
 
     # Apply Hakai Grey List
     # Grey List should overwrite the QARTOD Flags
     logger.debug("Apply Hakai Grey List")
-    df = hakai_tests.grey_list(df, HAKAI_GREY_LIST)
+    df = hakai_tests.grey_list(df, context.grey_list)
 
     # Make sure that missing values and bad values are appropriately flagged
-    for variable in df.columns:
-        bad_value_flag = f"{variable}_hakai_bad_value_test"
-        if bad_value_flag in df.columns:
-            df.loc[df[bad_value_flag].isin([3, 4, 9]), f"{variable}_flag_level_1"] = (
-                df.loc[df[bad_value_flag].isin([3, 4, 9]), bad_value_flag]
-            )
+    flagged_variables = [
+        variable
+        for variable in df.columns
+        if f"{variable}_hakai_bad_value_test" in df.columns
+    ]
+    bad_value_flags = df[
+        [f"{variable}_hakai_bad_value_test" for variable in flagged_variables]
+    ].to_numpy()
+    is_bad_value = np.isin(bad_value_flags, [3, 4, 9])
+    for position, variable in enumerate(flagged_variables):
+        if f"{variable}_flag_level_1" not in df:
+            df[f"{variable}_flag_level_1"] = np.nan
+        is_bad = is_bad_value[:, position]
+        if is_bad.any():
+            df.loc[is_bad, f"{variable}_flag_level_1"] = bad_value_flags[
+                is_bad, position
+            ]
 
     return df
 
 
 @logger.catch(default=pd.DataFrame())
-@retry()
-def get_hakai_data(url):
-    """Run query to hakai api and return a pandas dataframe if sucessfull."""
-    response = client.get(url)
+@async_retry()
+async def aget_hakai_data(url, use_cache=True):
+    """Run query to hakai api and return a pandas dataframe if sucessfull.
+    The response is retrieved from the local cache if available."""
+    cache = get_context().response_cache if use_cache else None
+    if cache and (cached := cache.get(url)) is not None:
+        return cached
+    response = await async_io.request(get_context().client, "get", url)
+    response.raise_for_status()
+    df = pd.DataFrame(response.json())
+    if cache:
+        cache.put(url, df)
+    return df
+
+
+async def _post_hakai_data(url, post):
+    response = await async_io.request(get_context().client, "post", url, data=post)
     response.raise_for_status()
-    return pd.DataFrame(response.json())
 
 
 @logger.catch(default=pd.DataFrame())
-@retry()
+@async_retry()
+async def apost_hakai_data(url, post):
+    """Post data to hakai api"""
+    await _post_hakai_data(url, post)
+
+
+def get_hakai_data(url, use_cache=True):
+    """Run query to hakai api and return a pandas dataframe if sucessfull."""
+    return async_io.run(aget_hakai_data(url, use_cache=use_cache))
+
+
+def get_hakai_data_concurrently(*urls):
+    """Run independent queries to hakai api concurrently and return
+    a pandas dataframe for each of them."""
+    return async_io.run(async_io.gather(*[aget_hakai_data(url) for url in urls]))
+
+
 def post_hakai_data(url, post):
     """Post data to hakai api"""
-    response = client.post(url, post)
-    response.raise_for_status()
+    return async_io.run(apost_hakai_data(url, post))
+
+
+def upload_hakai_data(posts, max_concurrent_uploads=5, attempts=3, delay=1):
+    """Post data to hakai api concurrently with at most `max_concurrent_uploads`
+    requests in flight. Only the posts that failed are retried.
+
+    Args:
+        posts (dict): {key: (url, post)} to upload
+        max_concurrent_uploads (int): maximum number of requests in flight
+        attempts (int): maximum number of attempts for each post
+        delay (int): seconds to wait before retrying the failed posts
+
+    Returns:
+        dict: {key: None if uploaded successfully or the last error raised}
+    """
+    results = {}
+    pending = dict(posts)
+    for attempt in range(1, attempts + 1):
+        with tqdm(total=len(pending), desc="Upload to server", unit="cast") as pbar:
+            errors = async_io.run(
+                async_io.gather_bounded(
+                    [_post_hakai_data(url, post) for url, post in pending.values()],
+                    max_concurrent_uploads,
+                    pbar=pbar,
+                )
+            )
+        results.update(zip(pending, errors))
+        pending = {key: posts[key] for key, error in zip(pending, errors) if error}
+        if not pending:
+            break
+        logger.warning(
+            "Failed to upload {}/{} posts (attempt {}/{})",
+            len(pending),
+            len(posts),
+            attempt,
+            attempts,
+        )
+        if attempt < attempts:
+            time.sleep(delay)
+
+    for key in pending:
+        logger.error("Failed to upload {}: {}", key, results[key])
+    return results
+
+
+def _chunk_queries(hakai_ids: list, api_root: str) -> tuple:
+    """Generate the data, metadata and manual qc queries of a chunk of casts."""
+    query = "%s/ctd/views/file/cast/data?hakai_id={%s}&limit=-1&fields=%s" % (
+        api_root,
+        ",".join(hakai_ids),
+        ",".join(variables.CTD_CAST_DATA_VARIABLES),
+    )
+    metadata_query = "%s/ctd/views/file/cast?hakai_id={%s}&limit=-1" % (
+        api_root,
+        ",".join(hakai_ids),
+    )
+    manual_qc_query = "%s/eims/views/output/ctd_qc?hakai_id={%s}&limit=-1&fields=%s" % (
+        api_root,
+        ",".join(hakai_ids),
+        ",".join(manual_qc_variables),
+    )
+    return query, metadata_query, manual_qc_query
+
+
+def _fetch_chunk(chunk: pd.DataFrame, api_root: str) -> dict:
+    """Retrieve the data, metadata and manual qc flags associated with a
+    chunk of casts."""
+    start_time = time.perf_counter()
+    queries = _chunk_queries(chunk["hakai_id"].values, api_root)
+    logger.debug("Run query: {}", queries[0])
+    data, metadata, manual_qc = get_hakai_data_concurrently(*queries)
+    return dict(
+        chunk=chunk,
+        data=data,
+        metadata=metadata,
+        manual_qc=manual_qc,
+        fetch_duration=time.perf_counter() - start_time,
+    )
+
+
+def _qc_chunk(
+    chunk: pd.DataFrame,
+    data: pd.DataFrame,
+    metadata: pd.DataFrame,
+    manual_qc: pd.DataFrame,
+    fetch_duration: float = 0,
+    sentry_minimum_date: pd.Timestamp = None,
+    result_cache: str = None,
+) -> dict:
+    """Run the qc on a retrieved chunk of casts and prepare the results to be
+    uploaded.
+
+    Returns:
+        dict: chunk with updated processing_stage, the qced data restricted
+            to the original variables (None if no data was retrieved) and
+            the chunk statistics (records per cast, memory usage and duration).
+    """
+    if data.empty:
+        logger.error(
+            "Failed to retrieve profile data for the hakai_ids: {}",
+            chunk["hakai_id"],
+        )
+        return dict(chunk=chunk, data=None, stats=None)
+    start_time = time.perf_counter()
+    original_variables = data.columns
+
+    # Generate derived variables and convert time
+    df_qced = _derived_ocean_variables(data)
+    df_qced = _convert_time_to_datetime(df_qced)
+
+    # Include manual_qc
+    manual_qc = manual_qc.set_index("hakai_id").replace(hakai_to_qartod_flag).fillna(2)
+    manual_qc.columns = [
+        col.replace("_flag", "_manual_qc_flag") for col in manual_qc.columns
+    ]
+    df_qced = df_qced.merge(manual_qc, on="hakai_id", how="left")
+
+    # Run QC Process
+    logger.debug("Run QC Process")
+    df_qced = run_qc_profiles(
+        df_qced, metadata, cache=ResultCache(result_cache) if result_cache else None
+    )
+    if sentry_minimum_date:
+        sentry_warnings.run_sentry_warnings(df_qced, chunk, sentry_minimum_date)
+
+    # Convert QARTOD to string temporarily
+    qartod_columns = df_qced.filter(regex="_flag_level_1").columns
+    df_qced[qartod_columns] = df_qced[qartod_columns].astype(str)
+    df_qced = df_qced.replace({"": None})
+
+    # Update qced casts processing_stage
+    chunk["processing_stage"] = chunk["processing_stage"].replace(
+        {"8_binAvg": "9_qc_auto", "8_rbr_processed": "9_qc_auto"}
+    )
+    chunk["process_error"] = chunk["process_error"].fillna("")
+
+    stats = dict(
+        records_per_cast=df_qced["hakai_id"].value_counts().to_dict(),
+        nbytes=df_qced.memory_usage(deep=True).sum(),
+        duration=fetch_duration + time.perf_counter() - start_time,
+    )
+
+    # Filter out extra variables generated during qc
+    return dict(chunk=chunk, data=df_qced[original_variables], stats=stats)
+
+
+def _upload_chunk(
+    chunk: pd.DataFrame,
+    data: pd.DataFrame,
+    api_root: str,
+    stats: dict = None,
+    upload_flag: bool = False,
+    max_concurrent_uploads: int = 5,
+) -> dict:
+    """Upload (if upload_flag) the qced flags of a chunk of casts.
+
+    Returns:
+        dict: hakai_ids of the casts processed (failed uploads excluded)
+            and the chunk statistics
+    """
+    if data is None:
+        return dict(hakai_ids=[], stats=stats)
+
+    # Upload to server
+    if not upload_flag:
+        logger.info("Do not upload results to {}", api_root)
+        return dict(hakai_ids=chunk["hakai_id"].tolist(), stats=stats)
+
+    logger.info("Upload results to {}", api_root)
+    casts_flags = _generate_process_flags_json(chunk, data)
+    results = upload_hakai_data(
+        {
+            hakai_id: (
+                f"{api_root}/ctd/process/flags/json/{ctd_cast_pk}",
+                casts_flags[hakai_id],
+            )
+            for hakai_id, ctd_cast_pk in zip(chunk["hakai_id"], chunk["ctd_cast_pk"])
+        },
+        max_concurrent_uploads=max_concurrent_uploads,
+    )
+    return dict(
+        hakai_ids=[hakai_id for hakai_id, error in results.items() if error is None],
+        stats=stats,
+    )
+
+
+def _process_chunk(
+    chunk: pd.DataFrame,
+    api_root: str,
+    upload_flag: bool = False,
+    max_concurrent_uploads: int = 5,
+    sentry_minimum_date: pd.Timestamp = None,
+    result_cache: str = None,
+) -> dict:
+    """Retrieve, qc and upload (if upload_flag) the data associated with a
+    chunk of casts.
+
+    Returns:
+        dict: hakai_ids of the casts processed and the chunk statistics
+    """
+    fetched = _fetch_chunk(chunk, api_root)
+    qced = _qc_chunk(
+        **fetched,
+        sentry_minimum_date=sentry_minimum_date,
+        result_cache=result_cache,
+    )
+    return _upload_chunk(
+        **qced,
+        api_root=api_root,
+        upload_flag=upload_flag,
+        max_concurrent_uploads=max_concurrent_uploads,
+    )
+
+
+def _failed_chunk(chunk: pd.DataFrame, error: Exception) -> dict:
+    """Log a chunk which failed to be processed, its casts are reported as failed"""
+    logger.opt(exception=error).error(
+        "Failed to process the hakai_ids: {}", chunk["hakai_id"].tolist()
+    )
+    return dict(hakai_ids=[], stats=None)
+
+
+def _process_chunks_pool(chunks, workers: int, context: QCContext, **chunk_kwargs):
+    """Process chunks within a pool of `workers` processes.
+
+    Chunks are dispatched from a shared queue: each worker pulls the next
+    chunk as soon as it is done with the previous one, so slow chunks never
+    hold up the rest of the casts. Chunks are only generated once a worker
+    is about to be available (at most 2 chunks per worker are queued) to let
+    the adaptive chunker account for the latest chunks processed.
+
+    Yields:
+        tuple: (chunk, processed chunk results) in the order the chunks
+            are completed
+    """
+    chunks = iter(chunks)
+    # Workers reuse the station list, grey list and configurations
+    # retrieved once by this process
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=set_context,
+        initargs=(context.preload(),),
+    ) as executor:
+        futures = {}
+
+        def _submit_next_chunk():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                future = executor.submit(_process_chunk, chunk, **chunk_kwargs)
+                futures[future] = chunk
+
+        for _ in range(2 * workers):
+            _submit_next_chunk()
+        while futures:
+            future = next(as_completed(futures))
+            chunk = futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as error:
+                result = _failed_chunk(chunk, error)
+            yield chunk, result
+            _submit_next_chunk()
+
+
+def _process_chunks_pipeline(
+    chunks: list,
+    max_chunks_in_memory: int,
+    api_root: str,
+    upload_flag: bool = False,
+    max_concurrent_uploads: int = 5,
+    sentry_minimum_date: pd.Timestamp = None,
+    result_cache: str = None,
+):
+    """Process chunks through a fetch -> qc -> upload pipeline.
+
+    The next chunks are retrieved and the previous ones uploaded within
+    background threads while the current chunk is qced. At most
+    `max_chunks_in_memory` chunks are held (fetched, qced or uploading)
+    at any given time. A chunk failing at any stage is reported as failed.
+
+    Yields:
+        tuple: (chunk, processed chunk results) in the order the chunks were given
+    """
+    max_chunks_in_memory = max(max_chunks_in_memory, 1)
+    chunks = iter(chunks)
+    pending_fetches, pending_uploads = deque(), deque()
+
+    with ThreadPoolExecutor(max_workers=1) as fetcher, ThreadPoolExecutor(
+        max_workers=1
+    ) as uploader:
+
+        def _has_room(n_qcing):
+            # Every chunk fetched, qcing or uploading counts against the limit
+            held = len(pending_fetches) + len(pending_uploads) + n_qcing
+            return held < max_chunks_in_memory
+
+        def _submit_fetches(n_qcing):
+            while _has_room(n_qcing):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                pending_fetches.append(
+                    (chunk, fetcher.submit(_fetch_chunk, chunk, api_root))
+                )
+
+        def _qc_and_upload(chunk, fetching):
+            # A chunk failing to be fetched or qced is queued with its failed
+            # result to be released in order with the uploaded chunks
+            try:
+                qced = _qc_chunk(
+                    **fetching.result(),
+                    sentry_minimum_date=sentry_minimum_date,
+                    result_cache=result_cache,
+                )
+            except Exception as error:
+                failed = Future()
+                failed.set_result(_failed_chunk(chunk, error))
+                return chunk, failed
+            return qced["chunk"], uploader.submit(
+                _upload_chunk,
+                **qced,
+                api_root=api_root,
+                upload_flag=upload_flag,
+                max_concurrent_uploads=max_concurrent_uploads,
+            )
+
+        def _release_oldest_upload():
+            chunk, future = pending_uploads.popleft()
+            try:
+                return chunk, future.result()
+            except Exception as error:
+                return chunk, _failed_chunk(chunk, error)
+
+        _submit_fetches(0)
+        while pending_fetches:
+            chunk, fetching = pending_fetches.popleft()
+            wait([fetching])
+
+            # Release completed uploads and prefetch the next chunks while qcing
+            while pending_uploads and pending_uploads[0][1].done():
+                yield _release_oldest_upload()
+            _submit_fetches(1)
+
+            pending_uploads.append(_qc_and_upload(chunk, fetching))
+            del fetching
+
+            # Wait for uploads only if the pipeline is full and nothing is left to qc
+            while pending_uploads and (
+                pending_uploads[0][1].done()
+                or (not pending_fetches and not _has_room(0))
+            ):
+                yield _release_oldest_upload()
+            _submit_fetches(0)
+
+        while pending_uploads:
+            yield _release_oldest_upload()
 
 
 @click.command()
@@ -446,6 +985,135 @@ def post_hakai_data(url, post):
     show_default=True,
     envvar="CTD_CAST_CHUNKSIZE",
 )
+@click.option(
+    "--adaptive-chunks",
+    help=(
+        "Size chunks by their estimated number of records, starting with "
+        "--chunksize casts [env=CTD_QC_ADAPTIVE_CHUNKS]"
+    ),
+    is_flag=True,
+    default=False,
+    envvar="CTD_QC_ADAPTIVE_CHUNKS",
+)
+@click.option(
+    "--memory-budget",
+    help="Maximum memory (MB) used by an adaptive chunk data [env=CTD_QC_MEMORY_BUDGET]",
+    type=float,
+    default=512,
+    show_default=True,
+    envvar="CTD_QC_MEMORY_BUDGET",
+)
+@click.option(
+    "--target-chunk-duration",
+    help="Target time (s) to retrieve and qc an adaptive chunk [env=CTD_QC_TARGET_CHUNK_DURATION]",
+    type=float,
+    default=60,
+    show_default=True,
+    envvar="CTD_QC_TARGET_CHUNK_DURATION",
+)
+@click.option(
+    "--max-url-length",
+    help="Maximum length of the queries used to retrieve an adaptive chunk [env=CTD_QC_MAX_URL_LENGTH]",
+    type=int,
+    default=8000,
+    show_default=True,
+    envvar="CTD_QC_MAX_URL_LENGTH",
+)
+@click.option(
+    "--workers",
+    help="Number of processes used to qc chunks in parallel [env=CTD_QC_WORKERS]",
+    type=int,
+    default=1,
+    show_default=True,
+    envvar="CTD_QC_WORKERS",
+)
+@click.option(
+    "--pipeline-chunks",
+    help=(
+        "Fetch, qc and upload chunks concurrently while holding at most this "
+        "number of chunks in memory, 0 processes chunks sequentially "
+        "[env=CTD_QC_PIPELINE_CHUNKS]"
+    ),
+    type=int,
+    default=0,
+    show_default=True,
+    envvar="CTD_QC_PIPELINE_CHUNKS",
+)
+@click.option(
+    "--upload-concurrency",
+    help="Maximum number of casts flags uploaded concurrently [env=CTD_QC_UPLOAD_CONCURRENCY]",
+    type=int,
+    default=5,
+    show_default=True,
+    envvar="CTD_QC_UPLOAD_CONCURRENCY",
+)
+@click.option(
+    "--journal",
+    "journal_path",
+    help=(
+        "Record the progress of each cast within this SQLite journal "
+        f"(default to {DEFAULT_JOURNAL_PATH} with --resume) [env=CTD_QC_JOURNAL]"
+    ),
+    type=click.Path(),
+    default=None,
+    envvar="CTD_QC_JOURNAL",
+)
+@click.option(
+    "--resume",
+    help="Skip the casts already completed by a previous identical run [env=CTD_QC_RESUME]",
+    is_flag=True,
+    default=False,
+    envvar="CTD_QC_RESUME",
+)
+@click.option(
+    "--qartod-engine",
+    help=(
+        "Run the QARTOD tests on each profile with ioos_qc or on all the "
+        "profiles of a chunk at once with the batch engine [env=CTD_QC_QARTOD_ENGINE]"
+    ),
+    type=click.Choice(QARTOD_ENGINES),
+    default="ioos_qc",
+    show_default=True,
+    envvar="CTD_QC_QARTOD_ENGINE",
+)
+@click.option(
+    "--result-cache",
+    help=(
+        "Reuse the qc results of the casts unchanged since a previous run "
+        "stored within this directory [env=CTD_QC_RESULT_CACHE]"
+    ),
+    type=click.Path(file_okay=False),
+    default=None,
+    envvar="CTD_QC_RESULT_CACHE",
+)
+@click.option(
+    "--api-cache-dir",
+    help=(
+        "Directory of the local cache of the hakai api responses "
+        f"(default to {DEFAULT_RESPONSE_CACHE_DIR}) [env=CTD_QC_API_CACHE_DIR]"
+    ),
+    type=click.Path(file_okay=False),
+    default=None,
+    envvar="CTD_QC_API_CACHE_DIR",
+)
+@click.option(
+    "--api-cache-size",
+    help="Maximum size (MB) of the local cache of the hakai api responses [env=CTD_QC_API_CACHE_SIZE]",
+    type=float,
+    default=500,
+    show_default=True,
+    envvar="CTD_QC_API_CACHE_SIZE",
+)
+@click.option(
+    "--api-cache",
+    help=(
+        "Cache the hakai api station list, casts metadata and manual flags "
+        "responses locally [env=CTD_QC_API_CACHE]"
+    ),
+    is_flag=True,
+    default=False,
+    envvar="CTD_QC_API_CACHE",
+)
 @click.option(
     "--sentry-minimum-date",
     type=str,
@@ -459,7 +1127,18 @@ def main_cli(**kwargs):
     main(**kwargs)
 
 
-@monitor(monitor_slug=os.getenv("SENTRY_MONITOR_ID"))
+def _sentry_monitor(func):
+    """Monitor the function with the sentry cron SENTRY_MONITOR_ID defined at runtime"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with monitor(monitor_slug=os.getenv("SENTRY_MONITOR_ID")):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@_sentry_monitor
 def main(
     hakai_ids: str = None,
     test_suite: bool = False,
@@ -467,8 +1146,23 @@ def main(
     upload_flag: bool = False,
     processing_stages: str = "8_binAvg,8_rbr_processed",
     chunksize: int = 100,
+    adaptive_chunks: bool = False,
+    memory_budget: float = 512,
+    target_chunk_duration: float = 60,
+    max_url_length: int = 8000,
+    workers: int = 1,
+    pipeline_chunks: int = 0,
+    upload_concurrency: int = 5,
+    journal_path: str = None,
+    resume: bool = False,
+    qartod_engine: str = "ioos_qc",
+    result_cache: str = None,
+    api_cache_dir: str = None,
+    api_cache_size: float = 500,
+    api_cache: bool = False,
     sentry_minimum_date: str = None,
     profile: str = None,
+    context: QCContext = None,
 ) -> dict:
     """QC Hakai Profiles on subset list of profiles given either via an
     hakai_id list, the `test_suite` flag or processing_stage.
@@ -486,10 +1180,39 @@ def main(
         upload_flag (bool): Update database flags
         processing_stages (str): Comma list of processing_stage profiles to review
         chunksize (int): Process profiles by chunk
+        adaptive_chunks (bool): Size chunks by their estimated number of records
+        memory_budget (float): Maximum memory (MB) used by an adaptive chunk data
+        target_chunk_duration (float): Target time (s) to retrieve and qc an
+            adaptive chunk
+        max_url_length (int): Maximum length of the queries used to retrieve
+            an adaptive chunk
+        workers (int): Number of processes used to qc chunks in parallel
+        pipeline_chunks (int): Maximum number of chunks held in memory while
+            fetching, qcing and uploading concurrently (ignored if workers > 1)
+        upload_concurrency (int): Maximum number of casts flags uploaded concurrently
+        journal_path (str): Record the progress of each cast within this SQLite journal
+        resume (bool): Skip the casts already completed by a previous identical run
+        qartod_engine (str): Run the QARTOD tests with ioos_qc or the batch engine
+        result_cache (str): Directory of the cache used to reuse the qc results
+            of the casts unchanged since a previous run
+        api_cache_dir (str): Directory of the local cache of the hakai api responses
+        api_cache_size (float): Maximum size (MB) of the hakai api responses cache
+        api_cache (bool): Cache the hakai api station list, casts metadata and
+            manual flags responses locally
         sentry_minimum_date (str): Minimum date to use to generate sentry warnings
         profile (str): Run cProfile on the process
+        context (QCContext): Resources used by the qc, set as the default
+            context (default to get_context())
 
     """
+    context = set_context(context) if context else get_context()
+    context.configure_api_cache(
+        directory=api_cache_dir, max_size=api_cache_size, enabled=api_cache
+    )
+    # Uploads may overlap the data, metadata and manual flags queries of the
+    # following chunk
+    context.configure_connection_pool(upload_concurrency + 3)
+    context.qartod_engine = qartod_engine
 
     check_hakai_database_rebuild(api_root)
     if profile:
@@ -518,7 +1241,8 @@ def main(
     # Retrieve casts to qc
     url = f"{api_root}/ctd/views/file/cast?{cast_filter_query}&limit=-1&fields={','.join(variables.CTD_CAST_VARIABLES)}"
     logger.info("Retrieve: {}", url)
-    df_casts = get_hakai_data(url)
+    # The casts selection depends on their processing_stage and is never cached
+    df_casts = get_hakai_data(url, use_cache=False)
     if df_casts.empty:
         logger.info("No Drops needs to be QC")
         return {
@@ -527,6 +1251,38 @@ def main(
             "hakai_ids": [],
         }
 
+    journal = None
+    if journal_path or resume:
+        journal = Journal(
+            journal_path or DEFAULT_JOURNAL_PATH,
+            run_key=hash_items(
+                api_root,
+                cast_filter_query,
+                upload_flag,
+                _qc_configuration_hash(context),
+            ),
+            metadata=dict(
+                version=__version__,
+                query=url,
+                upload_flag=upload_flag,
+            ),
+        )
+        journal.record("pending", df_casts[["ctd_cast_pk", "hakai_id"]].values)
+        if resume:
+            final_stage = "uploaded" if upload_flag else "qced"
+            is_completed = df_casts["ctd_cast_pk"].isin(journal.completed(final_stage))
+            logger.info(
+                "Resume run: skip {} casts already {}", is_completed.sum(), final_stage
+            )
+            df_casts = df_casts.loc[~is_completed]
+            if df_casts.empty:
+                logger.info("All drops were already qced")
+                return {
+                    "query": url,
+                    "message": "All drops were already qced",
+                    "hakai_ids": [],
+                }
+
     # Split cast list to qc into chunks and run qc tests on each chunks.
     logger.info("QC {} drops", len(df_casts))
     gen_pbar = tqdm(
@@ -537,93 +1293,67 @@ def main(
         dynamic_ncols=True,
         ncols=100,
     )
-    with logging_redirect_tqdm():
-        for chunk in np.array_split(df_casts, np.ceil(len(df_casts) / chunksize)):
-            # Retrieve cast data for this chunk
-            query = "%s/ctd/views/file/cast/data?hakai_id={%s}&limit=-1&fields=%s" % (
-                api_root,
-                ",".join(chunk["hakai_id"].values),
-                ",".join(variables.CTD_CAST_DATA_VARIABLES),
-            )
-            metadata_query = "%s/ctd/views/file/cast?hakai_id={%s}&limit=-1" % (
-                api_root,
-                ",".join(chunk["hakai_id"].values),
-            )
-            manual_qc_query = (
-                "%s/eims/views/output/ctd_qc?hakai_id={%s}&limit=-1&fields=%s"
-                % (
-                    api_root,
-                    ",".join(chunk["hakai_id"].values),
-                    ",".join(manual_qc_variables),
-                )
-            )
-
-            logger.debug("Run query: {}", query)
-            df_qced = get_hakai_data(query)
-            metadata = get_hakai_data(metadata_query)
-            manual_qc = get_hakai_data(manual_qc_query)
-
-            original_variables = df_qced.columns
-            if df_qced is None:
-                logger.error(
-                    "Failed to retrieve profile data for the hakai_ids: {}",
-                    chunk["hakai_id"],
-                )
-                continue
-
-            # Generate derived variables and convert time
-            df_qced = _derived_ocean_variables(df_qced)
-            df_qced = _convert_time_to_datetime(df_qced)
-
-            # Include manual_qc
-            manual_qc = (
-                manual_qc.set_index("hakai_id").replace(hakai_to_qartod_flag).fillna(2)
-            )
-            manual_qc.columns = [
-                col.replace("_flag", "_manual_qc_flag") for col in manual_qc.columns
-            ]
-            df_qced = df_qced.merge(manual_qc, on="hakai_id", how="left")
-
-            # Run QC Process
-            logger.debug("Run QC Process")
-            df_qced = run_qc_profiles(df_qced, metadata)
-            if sentry_minimum_date:
-                sentry_minimum_date = pd.to_datetime(
-                    sentry_minimum_date, utc=True, format="ISO8601"
-                )
-                sentry_warnings.run_sentry_warnings(df_qced, chunk, sentry_minimum_date)
+    if sentry_minimum_date:
+        sentry_minimum_date = pd.to_datetime(
+            sentry_minimum_date, utc=True, format="ISO8601"
+        )
+    if adaptive_chunks:
+        chunker = AdaptiveChunker(
+            df_casts,
+            initial_chunksize=chunksize,
+            memory_budget=memory_budget * 1e6,
+            target_duration=target_chunk_duration,
+            max_url_length=max_url_length,
+            url_overhead=max(len(query) for query in _chunk_queries([], api_root)),
+        )
+        chunks = iter(chunker)
+    else:
+        chunker = None
+        chunks = iter(np.array_split(df_casts, np.ceil(len(df_casts) / chunksize)))
+    chunk_kwargs = dict(
+        api_root=api_root,
+        upload_flag=upload_flag,
+        max_concurrent_uploads=upload_concurrency,
+        sentry_minimum_date=sentry_minimum_date,
+        result_cache=result_cache,
+    )
+    processed_hakai_ids = set()
 
-            # Convert QARTOD to string temporarily
-            qartod_columns = df_qced.filter(regex="_flag_level_1").columns
-            df_qced[qartod_columns] = df_qced[qartod_columns].astype(str)
-            df_qced = df_qced.replace({"": None})
+    def _chunk_processed(chunk, result):
+        processed_hakai_ids.update(result["hakai_ids"])
+        if chunker and result["stats"]:
+            chunker.record(**result["stats"])
+        if journal:
+            _journal_chunk(journal, chunk, result, upload_flag)
+        gen_pbar.update(n=len(chunk))
+        logger.info("Processed: {}/{}", len(processed_hakai_ids), len(df_casts))
 
-            # Update qced casts processing_stage
-            chunk["processing_stage"] = chunk["processing_stage"].replace(
-                {"8_binAvg": "9_qc_auto", "8_rbr_processed": "9_qc_auto"}
+    with logging_redirect_tqdm():
+        if workers > 1:
+            logger.info("QC chunks with {} workers", workers)
+            for chunk, result in _process_chunks_pool(
+                chunks, workers, context, **chunk_kwargs
+            ):
+                _chunk_processed(chunk, result)
+        elif pipeline_chunks > 0:
+            logger.info(
+                "QC chunks through a pipeline holding at most {} chunks",
+                pipeline_chunks,
             )
-            chunk["process_error"] = chunk["process_error"].fillna("")
-
-            # Upload to server
-            if upload_flag:
-                # Filter out extra variables generated during qc
-                df_upload = df_qced[original_variables]
-                logger.info("Upload results to {}", api_root)
-                for _, row in tqdm(
-                    chunk.iterrows(),
-                    desc="Upload to server",
-                    unit="cast",
-                    total=len(chunk),
-                ):
-                    post_hakai_data(
-                        f"{api_root}/ctd/process/flags/json/{row['ctd_cast_pk']}",
-                        post=_generate_process_flags_json(row, df_upload),
-                    )
-            else:
-                logger.info("Do not upload results to {}", api_root)
-
-            gen_pbar.update(n=len(chunk))
-            logger.info("Processed: {}/{}", chunk["hakai_id"].values, len(df_casts))
+            for chunk, result in _process_chunks_pipeline(
+                chunks, pipeline_chunks, **chunk_kwargs
+            ):
+                _chunk_processed(chunk, result)
+        else:
+            for chunk in chunks:
+                try:
+                    result = _process_chunk(chunk, **chunk_kwargs)
+                except Exception as error:
+                    result = _failed_chunk(chunk, error)
+                _chunk_processed(chunk, result)
+    gen_pbar.close()
+    if journal:
+        journal.close()
 
     if "8_binAvg,8_rbr_processed,9_qc_auto,10_qc_pi" in run_type:
         logger.warning("Full CTD QC rebuild is completed on {}", api_root)
@@ -632,74 +1362,56 @@ def main(
     return {
         "query": url,
         "message": "Qc Process Completed",
-        "hakai_ids": df_casts["hakai_id"].tolist(),
+        "hakai_ids": [
+            hakai_id
+            for hakai_id in df_casts["hakai_id"]
+            if hakai_id in processed_hakai_ids
+        ],
+        "failed_hakai_ids": [
+            hakai_id
+            for hakai_id in df_casts["hakai_id"]
+            if hakai_id not in processed_hakai_ids
+        ],
     }
 
 
 def _get_hakai_flag_columns(
     df,
     variable,
-    flag_regex,
+    flag_regex=None,
+    flag_matrix: FlagMatrix = None,
 ):
     """
     Generate the different Level1 and Level2 flag columns by
     grouping the different tests results.
-    """
-
-    def __generate_level2_flag(row: pd.Series):
-        """
-        Regroup together tests results in "flag_value_to_consider" as a
-        json string to be outputed as a level2 flag
-        """
-        flags = row.dropna().to_dict()
-        if not flags:
-            return pd.NA
-        return "; ".join(
-            sorted(
-                [
-                    f"{hakai_tests.qartod_to_hakai_flag[qartod_flag]}: {test}"
-                    for test, qartod_flag in flags.items()
-                ],
-                reverse=True,
-            )
-        )
 
-    # Retrieve each flags column associated to a variable
-    df_subset_flag = df.filter(regex=flag_regex).replace({9: None, 2: None})
-    ignore_records = (df_subset_flag.notna().any(axis=1)) & (df[variable].notna())
-    df_subset = df_subset_flag.loc[ignore_records]
+    The tests results are retrieved from the given flag_matrix or else
+    from the columns matching flag_regex.
+    """
+    if flag_matrix is None:
+        flag_matrix = FlagMatrix(df, {variable: flag_regex})
 
-    if df_subset.empty:
+    # Retrieve the records with flags associated to the variable
+    rows, level_1 = flag_matrix.level_1(variable, df[variable].notna().to_numpy())
+    if rows.size == 0:
         return df
-
-    if f"{variable}_flag" in df_subset:
-        raise RuntimeError(
-            "Variable grouped flag considered in flag columns to compare"
-        )
-    if f"{variable}_flag_level_1" in df_subset:
-        raise RuntimeError(
-            "Variable flag level 1 considered in flag columns to compare"
-        )
+    index = df.index[rows]
 
     # Generete Level 1 Aggregated flag columns
     logger.debug("Get Aggregated QARTOD Level 1 Flags")
-    df.loc[df_subset.index, variable + "_flag_level_1"] = (
-        df_subset.astype(QARTOD_DTYPE).max(axis=1).astype(int)
-    )
+    df.loc[index, variable + "_flag_level_1"] = pd.Series(level_1, index=index)
     logger.debug("Get Aggregated Hakai Flags")
-    # Generete Level 2 Flag Description for failed flag
-    df.loc[df_subset.index, variable + "_flag"] = (
-        df_subset.astype("float64")
-        .replace({1: pd.NA})
-        .apply(
-            lambda x: __generate_level2_flag(x),
-            axis=1,
-        )
+    # Generete Level 2 Flag Description for failed flag. The records share the
+    # description of their combination of tests, the column is kept as object
+    # since the grey list appends its own descriptions to it
+    df.loc[index, variable + "_flag"] = pd.Series(
+        flag_matrix.level_2(variable, rows), index=index, dtype=object
     )
     return df
 
 
 if __name__ == "__main__":
+    setup()
     try:
         main_cli()
     except Exception as e:
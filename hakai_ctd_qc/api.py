@@ -15,9 +15,11 @@ from fastapi.responses import HTMLResponse
 from loguru import logger
 from hakai_api import Client
 
-from hakai_ctd_qc.__main__ import main as qc_profiles
+from hakai_ctd_qc.__main__ import main as qc_profiles, setup
 import panel as pn
 
+setup()
+
 
 def get_version_from_pyproject():
     with open("pyproject.toml") as f:
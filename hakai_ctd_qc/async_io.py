@@ -0,0 +1,82 @@
+"""Async I/O
+Run independent Hakai API requests concurrently over the pooled keep-alive
+connections of the hakai_api client session.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import DEFAULT_RETRIES, HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+
+def mount_connection_pool(session, pool_size=DEFAULT_POOL_SIZE):
+    """Mount adapters on the session that keep up to `pool_size`
+    connections alive per host, so that concurrent requests don't have to
+    renegotiate a new connection each time.
+
+    `pool_size` should be at least the number of concurrent requests,
+    otherwise the connections exceeding the pool are discarded once done.
+    The retry settings of the adapters previously mounted are retained.
+    """
+    for prefix in ("https://", "http://"):
+        previous = session.adapters.get(prefix)
+        session.mount(
+            prefix,
+            HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=getattr(previous, "max_retries", DEFAULT_RETRIES),
+            ),
+        )
+    return session
+
+
+async def request(session, method, url, **kwargs):
+    """Send a request with the given session without blocking the event loop."""
+    return await asyncio.to_thread(getattr(session, method), url, **kwargs)
+
+
+async def gather(*coroutines):
+    """Run coroutines concurrently and return their results in order."""
+    return await asyncio.gather(*coroutines)
+
+
+def run(coroutine):
+    """Run a coroutine to completion from synchronous code.
+
+    If an event loop is already running in this thread (ex: within the fastapi
+    application), the coroutine is run within a separate thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+async def gather_bounded(coroutines, limit, pbar=None):
+    """Run coroutines concurrently with at most `limit` of them in flight.
+
+    Exceptions raised by a coroutine are returned in place of its result,
+    so that one failure doesn't cancel the others.
+
+    Returns:
+        list: results (or exceptions) in the order of the given coroutines
+    """
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def _bounded(coroutine):
+        async with semaphore:
+            try:
+                return await coroutine
+            finally:
+                if pbar is not None:
+                    pbar.update()
+
+    return await asyncio.gather(
+        *[_bounded(coroutine) for coroutine in coroutines], return_exceptions=True
+    )
@@ -0,0 +1,147 @@
+"""Cache
+Local caches used to avoid repeating work between runs.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pandas as pd
+from loguru import logger
+
+DEFAULT_RESPONSE_CACHE_DIR = Path.home() / ".cache" / "hakai_ctd_qc" / "api"
+# Time to live (seconds) of the responses of each endpoint, the responses of
+# the other endpoints, including the casts data, aren't cached
+DEFAULT_RESPONSE_TTLS = {
+    "/eims/views/output/sites": 24 * 3600,
+    "/eims/views/output/ctd_qc": 3600,
+    "/ctd/views/file/cast": 3600,
+}
+
+
+class ResultCache:
+    """Content-addressed cache of the qc results of each cast.
+
+    Results are stored as pickle files named by the cast fingerprint, so that
+    any change to the cast data, manual flags, grey list, configuration,
+    QARTOD engine or package version generates a new fingerprint and the cast
+    gets qced again. Pickle is used to retain the exact dtypes of the qc
+    results.
+
+    Args:
+        directory (str): directory where the results are stored
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, fingerprint):
+        return self.directory / fingerprint[:2] / f"{fingerprint}.pkl"
+
+    def get(self, fingerprint):
+        """Retrieve the cached results or None if not available"""
+        path = self._path(fingerprint)
+        if not path.exists():
+            return None
+        try:
+            return pd.read_pickle(path)
+        except Exception as error:
+            logger.warning("Failed to read cached result {}: {}", path, error)
+            return None
+
+    def put(self, fingerprint, result: pd.DataFrame):
+        """Save results to the cache"""
+        path = self._path(fingerprint)
+        path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first to never leave a partial file behind
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+            result.to_pickle(file.name)
+        os.replace(file.name, path)
+
+
+class ResponseCache:
+    """Local cache of the hakai api responses stored as parquet files.
+
+    Each endpoint has its own time to live, a response older than its time to
+    live is ignored. Once the cache exceeds `max_size`, the least recently
+    used responses are removed. The file modification time records when a
+    response was retrieved and its access time when it was last used.
+
+    Args:
+        directory (str): directory where the responses are stored
+        ttls (dict): {endpoint: time to live in seconds}
+        max_size (float): maximum size of the cache in bytes
+    """
+
+    def __init__(self, directory, ttls: dict = None, max_size: float = 500e6):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttls = DEFAULT_RESPONSE_TTLS if ttls is None else ttls
+        self.max_size = max_size
+
+    def ttl(self, url):
+        """Time to live of the given url response, 0 if it isn't cached"""
+        path = urlsplit(url).path.rstrip("/")
+        return next(
+            (ttl for endpoint, ttl in self.ttls.items() if path.endswith(endpoint)),
+            0,
+        )
+
+    def _path(self, url):
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.parquet"
+
+    def get(self, url):
+        """Retrieve the cached response or None if not available or expired"""
+        ttl = self.ttl(url)
+        path = self._path(url)
+        if not ttl or not path.exists():
+            return None
+        retrieved_at = path.stat().st_mtime
+        if time.time() - retrieved_at > ttl:
+            return None
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path, (time.time(), retrieved_at))
+        except Exception as error:
+            logger.warning("Failed to read cached response {}: {}", path, error)
+            return None
+        logger.debug("Retrieve {} from cache", url)
+        return df
+
+    def put(self, url, response: pd.DataFrame):
+        """Save a response to the cache and evict the least recently used
+        responses if the cache exceeds its maximum size"""
+        if not self.ttl(url):
+            return
+        path = self._path(url)
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as file:
+            pass
+        try:
+            response.to_parquet(file.name)
+            os.replace(file.name, path)
+        except Exception as error:
+            logger.debug("Failed to cache response {}: {}", url, error)
+            Path(file.name).unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used responses exceeding the cache size"""
+        files = []
+        for path in self.directory.glob("*.parquet"):
+            try:
+                files.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+        size = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda file: file[0].st_atime):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= stat.st_size
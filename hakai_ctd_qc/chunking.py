@@ -0,0 +1,156 @@
+"""Chunking
+Split the list of casts to qc into chunks sized by their estimated number of
+records rather than a fixed number of casts.
+"""
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+
+class AdaptiveChunker:
+    """Iterate over chunks of casts sized to stay within a memory budget,
+    a target processing duration and a maximum query url length.
+
+    The number of records per cast (by cast_type), the memory used per record
+    and the time spent to retrieve and qc each record are unknown until the
+    first chunks are processed. The first chunk is therefore limited to
+    `initial_chunksize` casts and the following chunks are sized from the
+    statistics recorded with `record`, which are smoothed with an exponential
+    moving average.
+
+    Args:
+        casts (pd.DataFrame): casts to qc with at least a hakai_id column
+        initial_chunksize (int): number of casts in the first chunk
+        memory_budget (float): maximum memory (bytes) used by a chunk data
+        target_duration (float): target duration (seconds) to retrieve and qc
+            a chunk
+        max_url_length (int): maximum length of the queries used to retrieve
+            a chunk
+        url_overhead (int): length of the longest query without the hakai_ids
+        smoothing (float): weight given to the latest chunk statistics
+    """
+
+    def __init__(
+        self,
+        casts: pd.DataFrame,
+        initial_chunksize: int = 100,
+        memory_budget: float = 512e6,
+        target_duration: float = 60,
+        max_url_length: int = 8000,
+        url_overhead: int = 0,
+        smoothing: float = 0.5,
+    ):
+        self.casts = casts
+        self.initial_chunksize = initial_chunksize
+        self.memory_budget = memory_budget
+        self.target_duration = target_duration
+        self.max_url_length = max_url_length
+        self.url_overhead = url_overhead
+        self.smoothing = smoothing
+
+        self.position = 0
+        self.cast_types = (
+            casts["cast_type"].fillna("").values
+            if "cast_type" in casts
+            else np.full(len(casts), "")
+        )
+        self._cast_type_by_hakai_id = dict(zip(casts["hakai_id"], self.cast_types))
+        self.records_per_cast = {}
+        self.bytes_per_record = None
+        self.seconds_per_record = None
+
+    def _update(self, current, value):
+        if current is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * current
+
+    def record(
+        self, records_per_cast: dict, nbytes: float = None, duration: float = None
+    ):
+        """Update the chunk size estimates from a processed chunk statistics.
+
+        Args:
+            records_per_cast (dict): {hakai_id: number of records}
+            nbytes (float): memory used by the chunk data
+            duration (float): time spent to retrieve and qc the chunk
+        """
+        records = pd.Series(records_per_cast, dtype=float)
+        if records.empty:
+            return
+        cast_types = records.index.map(self._cast_type_by_hakai_id).fillna("")
+        for cast_type, mean_records in records.groupby(cast_types).mean().items():
+            self.records_per_cast[cast_type] = self._update(
+                self.records_per_cast.get(cast_type), mean_records
+            )
+
+        n_records = records.sum()
+        if n_records == 0:
+            return
+        if nbytes:
+            self.bytes_per_record = self._update(
+                self.bytes_per_record, nbytes / n_records
+            )
+        if duration:
+            self.seconds_per_record = self._update(
+                self.seconds_per_record, duration / n_records
+            )
+        logger.debug(
+            "Chunk estimates: records_per_cast={}, bytes_per_record={}, seconds_per_record={}",
+            self.records_per_cast,
+            self.bytes_per_record,
+            self.seconds_per_record,
+        )
+
+    def max_records(self):
+        """Maximum number of records per chunk given the current estimates."""
+        limits = []
+        if self.bytes_per_record and self.memory_budget:
+            limits.append(self.memory_budget / self.bytes_per_record)
+        if self.seconds_per_record and self.target_duration:
+            limits.append(self.target_duration / self.seconds_per_record)
+        return min(limits) if limits else None
+
+    def estimated_records(self, start, end):
+        """Estimated number of records of each cast from start to end."""
+        if not self.records_per_cast:
+            return None
+        default = np.mean(list(self.records_per_cast.values()))
+        return np.array(
+            [
+                self.records_per_cast.get(cast_type, default)
+                for cast_type in self.cast_types[start:end]
+            ]
+        )
+
+    def next_chunk_size(self):
+        """Number of casts to include in the next chunk."""
+        start = self.position
+        max_records = self.max_records()
+        estimated_records = self.estimated_records(start, len(self.casts))
+        if max_records is None or estimated_records is None:
+            n_casts = self.initial_chunksize
+        else:
+            n_casts = np.searchsorted(
+                np.cumsum(estimated_records), max_records, side="right"
+            )
+
+        # Keep the hakai_id={...} queries under the maximum url length
+        if self.max_url_length:
+            ids_length = np.cumsum(
+                self.casts["hakai_id"].iloc[start:].str.len().values + 1
+            )
+            n_casts = min(
+                n_casts,
+                np.searchsorted(
+                    ids_length, self.max_url_length - self.url_overhead, side="right"
+                ),
+            )
+        return int(max(n_casts, 1))
+
+    def __iter__(self):
+        while self.position < len(self.casts):
+            n_casts = self.next_chunk_size()
+            chunk = self.casts.iloc[self.position : self.position + n_casts].copy()
+            self.position += n_casts
+            yield chunk
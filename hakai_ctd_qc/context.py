@@ -0,0 +1,186 @@
+"""Context
+Runtime resources used to qc the profiles: the hakai api client, the tests
+configurations, the grey list and the station list. Each resource is only
+initialized when first used, so that importing the package has no side effect
+and a context can be reused between runs.
+"""
+
+import json
+import os
+from functools import cached_property
+from pathlib import Path
+
+import pandas as pd
+from hakai_api import Client
+from loguru import logger
+
+from hakai_ctd_qc import async_io, hakai_tests
+from hakai_ctd_qc.cache import DEFAULT_RESPONSE_CACHE_DIR, ResponseCache
+from hakai_ctd_qc.qc_config import CompiledQCConfig, compile_qc_config
+
+PACKAGE_PATH = Path(__file__).parent
+HAKAI_TESTS_CONFIGURATION_PATH = (
+    PACKAGE_PATH / "config" / "hakai_ctd_profile_tests_config.json"
+)
+QARTOD_TESTS_CONFIGURATION_PATH = (
+    PACKAGE_PATH / "config" / "hakai_ctd_profile_qartod_test_config.json"
+)
+GREY_LIST_PATH = PACKAGE_PATH / "HakaiProfileDatasetGreyList.csv"
+STATION_LIST_URL = "https://hecate.hakai.org/api/eims/views/output/sites?limit=-1"
+QARTOD_ENGINES = ("ioos_qc", "batch")
+
+
+def get_hakai_station_list(client, cache: ResponseCache = None):
+    """get_hakai_station_list
+        Retrieve station list available within the Hakai production database.
+
+    Returns:
+        dataframe: full dataframe list of stations and
+            associated depth, latitude, and longitude
+    """
+    stations = cache.get(STATION_LIST_URL) if cache else None
+    if stations is None:
+        stations = pd.DataFrame(client.get(STATION_LIST_URL).json())
+        if cache:
+            cache.put(STATION_LIST_URL, stations)
+    return stations.rename(columns={"name": "station", "depth": "station_depth"})
+
+
+class QCContext:
+    """Resources used to retrieve, qc and upload the profiles.
+
+    Args:
+        credentials (str): hakai api credentials (default to the
+            HAKAI_API_TOKEN environment variable)
+        api_cache_dir (str): directory of the local cache of the hakai api
+            responses (default to DEFAULT_RESPONSE_CACHE_DIR)
+        api_cache_size (float): maximum size of the cache in MB
+        api_cache (bool): cache the hakai api responses, disabled by default
+        pool_size (int): number of connections kept alive by the hakai api
+            client, at least the number of concurrent requests
+        qartod_engine (str): run the QARTOD tests on each profile with
+            "ioos_qc" or on all the profiles at once with "batch"
+    """
+
+    # Resources sent with the settings to other processes. The api client and
+    # responses cache are bound to each process and the compiled qc
+    # configurations can't be pickled, they are initialized by each process.
+    _SHARED_RESOURCES = (
+        "hakai_tests_config",
+        "qartod_config",
+        "grey_list",
+        "stations",
+    )
+
+    def __init__(
+        self,
+        credentials: str = None,
+        api_cache_dir: str = None,
+        api_cache_size: float = 500,
+        api_cache: bool = False,
+        qartod_engine: str = "ioos_qc",
+        pool_size: int = async_io.DEFAULT_POOL_SIZE,
+    ):
+        self.credentials = credentials
+        self.api_cache_dir = api_cache_dir
+        self.api_cache_size = api_cache_size
+        self.api_cache = api_cache
+        self.qartod_engine = qartod_engine
+        self.pool_size = pool_size
+
+    def configure_api_cache(
+        self, directory: str = None, max_size: float = 500, enabled: bool = False
+    ):
+        """Update the settings of the hakai api responses cache"""
+        settings = (directory, max_size, enabled)
+        if settings == (self.api_cache_dir, self.api_cache_size, self.api_cache):
+            return
+        self.api_cache_dir, self.api_cache_size, self.api_cache = settings
+        self.__dict__.pop("response_cache", None)
+
+    def configure_connection_pool(self, concurrency: int):
+        """Keep enough connections alive for `concurrency` concurrent requests"""
+        pool_size = max(concurrency, async_io.DEFAULT_POOL_SIZE)
+        if pool_size == self.pool_size:
+            return
+        self.pool_size = pool_size
+        if "client" in self.__dict__:
+            async_io.mount_connection_pool(self.client, pool_size)
+
+    @cached_property
+    def client(self):
+        if "HAKAI_API_TOKEN" in os.environ:
+            logger.info(
+                "HAKAI_API_TOKEN as env variable: {}",
+                len(os.environ["HAKAI_API_TOKEN"]),
+            )
+        return async_io.mount_connection_pool(
+            Client(credentials=self.credentials or os.environ.get("HAKAI_API_TOKEN")),
+            self.pool_size,
+        )
+
+    @cached_property
+    def response_cache(self):
+        if not self.api_cache:
+            logger.info("Hakai API responses cache is disabled")
+            return None
+        try:
+            return ResponseCache(
+                self.api_cache_dir or DEFAULT_RESPONSE_CACHE_DIR,
+                max_size=self.api_cache_size * 1e6,
+            )
+        except OSError as error:
+            logger.warning("Hakai API responses won't be cached: {}", error)
+            return None
+
+    @cached_property
+    def hakai_tests_config(self):
+        return json.loads(HAKAI_TESTS_CONFIGURATION_PATH.read_text())
+
+    @cached_property
+    def qartod_config(self):
+        return json.loads(QARTOD_TESTS_CONFIGURATION_PATH.read_text())
+
+    @cached_property
+    def qc_config(self) -> CompiledQCConfig:
+        return compile_qc_config(self.qartod_config, self.hakai_tests_config)
+
+    @cached_property
+    def grey_list(self):
+        return hakai_tests.load_grey_list(GREY_LIST_PATH)
+
+    @cached_property
+    def stations(self):
+        return get_hakai_station_list(self.client, self.response_cache)
+
+    def preload(self):
+        """Initialize the resources shared with other processes"""
+        for resource in self._SHARED_RESOURCES:
+            getattr(self, resource)
+        return self
+
+    def __getstate__(self):
+        return {
+            key: value
+            for key, value in self.__dict__.items()
+            if key in self._SHARED_RESOURCES
+            or not isinstance(getattr(type(self), key, None), cached_property)
+        }
+
+
+_context = None
+
+
+def get_context() -> QCContext:
+    """Retrieve the context used by default, created on first use."""
+    global _context
+    if _context is None:
+        _context = QCContext()
+    return _context
+
+
+def set_context(context: QCContext) -> QCContext:
+    """Set the context used by default."""
+    global _context
+    _context = context
+    return context
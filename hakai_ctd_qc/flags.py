@@ -0,0 +1,139 @@
+"""Flags
+Columnar store of the tests results used to aggregate the flags of each
+variable. The flags of every registered test are stored once as a compact
+uint8 matrix (records x tests) and the tests affecting each variable are
+resolved once as column indices of that matrix.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from hakai_ctd_qc.hakai_tests import qartod_to_hakai_flag
+
+# Missing flags are stored as 0
+FLAG_VALUES = (1, 2, 3, 4, 9)
+# Rank of each flag within the level 1 aggregation: UNKNOWN (2) and
+# MISSING (9) flags are ignored, FAIL (4) > SUSPECT (3) > GOOD (1)
+FLAG_RANK = np.zeros(max(FLAG_VALUES) + 1, dtype=np.uint8)
+FLAG_RANK[[1, 3, 4]] = [1, 2, 3]
+RANK_FLAG = np.array([0, 1, 3, 4])
+
+
+class FlagMatrix:
+    """Flags of the registered tests of a dataframe.
+
+    Each test (column of the dataframe) is registered with the variables it
+    affects, given by a regex selector of the tests columns for each
+    variable.
+
+    Args:
+        df (pd.DataFrame): tests results
+        selectors (dict): {variable: regex matching its tests columns}
+    """
+
+    def __init__(self, df: pd.DataFrame, selectors: dict):
+        selectors = {
+            variable: re.compile(selector) for variable, selector in selectors.items()
+        }
+        self.tests = tuple(
+            column
+            for column in df.columns
+            if any(selector.search(column) for selector in selectors.values())
+        )
+        self.registry = {
+            test: tuple(
+                variable
+                for variable, selector in selectors.items()
+                if selector.search(test)
+            )
+            for test in self.tests
+        }
+        self.indices = {
+            variable: np.array(
+                [
+                    index
+                    for index, test in enumerate(self.tests)
+                    if variable in self.registry[test]
+                ],
+                dtype=int,
+            )
+            for variable in selectors
+        }
+
+        for variable, tests in self.indices.items():
+            tests = [self.tests[index] for index in tests]
+            if f"{variable}_flag" in tests:
+                raise RuntimeError(
+                    "Variable grouped flag considered in flag columns to compare"
+                )
+            if f"{variable}_flag_level_1" in tests:
+                raise RuntimeError(
+                    "Variable flag level 1 considered in flag columns to compare"
+                )
+
+        values = df[list(self.tests)].astype("float64").to_numpy()
+        is_valid = np.isnan(values) | np.isin(values, FLAG_VALUES)
+        if not is_valid.all():
+            raise ValueError(
+                "Unexpected flag values {} in {}".format(
+                    np.unique(values[~is_valid]).tolist(),
+                    [self.tests[i] for i in np.unique(np.nonzero(~is_valid)[1])],
+                )
+            )
+        self.values = np.nan_to_num(values, nan=0).astype(np.uint8)
+
+    def level_1(self, variable, is_considered=None):
+        """Aggregate the flags of the tests affecting a variable into the
+        highest flag ignoring UNKNOWN and MISSING flags.
+
+        Args:
+            variable (str): aggregated variable
+            is_considered (np.ndarray): boolean mask of the records to
+                consider (default to all records)
+
+        Returns:
+            (np.ndarray, np.ndarray): positions of the records with at least
+                one flag and their aggregated flag
+        """
+        ranks = FLAG_RANK[self.values[:, self.indices[variable]]].max(axis=1, initial=0)
+        is_flagged = ranks > 0
+        if is_considered is not None:
+            is_flagged &= is_considered
+        rows = np.flatnonzero(is_flagged)
+        return rows, RANK_FLAG[ranks[rows]]
+
+    def _describe(self, indices, flags):
+        failed = [
+            f"{qartod_to_hakai_flag[flag]}: {self.tests[index]}"
+            for index, flag in zip(indices, flags)
+            if flag
+        ]
+        return "; ".join(sorted(failed, reverse=True)) if failed else pd.NA
+
+    def level_2(self, variable, rows):
+        """Describe the SUSPECT and FAIL tests affecting a variable of each
+        record, pd.NA for the records without any.
+
+        Each distinct combination of SUSPECT and FAIL tests is described once
+        and the description is shared by all the records with this
+        combination.
+
+        Args:
+            variable (str): aggregated variable
+            rows (np.ndarray): positions of the described records
+
+        Returns:
+            np.ndarray: descriptions of each record
+        """
+        indices = self.indices[variable]
+        flags = self.values[np.ix_(rows, indices)]
+        flags = np.where(np.isin(flags, (3, 4)), flags, 0)
+        combinations, codes = np.unique(flags, axis=0, return_inverse=True)
+        codes = codes.reshape(-1)
+        descriptions = np.array(
+            [self._describe(indices, combination) for combination in combinations],
+            dtype=object,
+        )
+        return descriptions[codes]
@@ -2,18 +2,197 @@
 Regroup Hakai CTD profiles specific tests to be applied during the QC step.
 """
 
+import numbers
 import re
 import warnings
+from typing import NamedTuple
 
 import numpy as np
 import pandas as pd
 from ioos_qc.qartod import QartodFlags
 from loguru import logger
 
+from hakai_ctd_qc.predicates import compile_predicate
+
 # Import Hakai Station List
 
 qartod_to_hakai_flag = {1: "AV", 2: "NA", 3: "SVC", 4: "SVD", 9: "MV"}
 
+# Seabird flag value ingested within the Hakai database
+SEABIRD_BAD_VALUE = -9.99e-29
+# Relative tolerance used to compare float records with bad values
+BAD_VALUE_RTOL = 1e-6
+
+
+class GroupCodes:
+    """Group of each record used to broadcast the results of tests computed
+    for each group (profile, cast, station...) back to the records without
+    merging them with the dataframe.
+
+    Args:
+        codes (np.ndarray): position of each record group within keys,
+            -1 for the records without group
+        keys (pd.Index): sorted keys of the groups
+
+    Attributes:
+        size (int): number of records
+    """
+
+    def __init__(self, codes: np.ndarray, keys: pd.Index):
+        self.codes = codes
+        self.keys = keys
+        self.size = len(codes)
+
+    @classmethod
+    def of(cls, df: pd.DataFrame, by: list, dropna=True):
+        """Group the records of a dataframe as df.groupby(by, sort=True)"""
+        grouped = df.groupby(list(by), sort=True, dropna=dropna)
+        return cls(
+            grouped.ngroup().fillna(-1).to_numpy(dtype=int),
+            grouped.size().index,
+        )
+
+    def broadcast(self, values, groups=None, fill_value=np.nan) -> np.ndarray:
+        """Broadcast the value of each group to its records.
+
+        Args:
+            values (array-like): value of each group
+            groups (np.ndarray): codes of the groups of each value (default
+                to all the groups in order)
+            fill_value: value of the records without group or whose group
+                has no value
+
+        Returns:
+            np.ndarray: value of each record, values dtype is retained if
+                every record has a value
+        """
+        values = np.asarray(values)
+        if groups is None:
+            groups = np.arange(len(self.keys))
+        positions = np.full(len(self.keys) + 1, -1)
+        positions[groups] = np.arange(len(groups))
+        # Records without group (-1) refer to the last position
+        positions = positions[self.codes]
+        if values.size == 0:
+            return np.full(self.size, fill_value)
+        if (positions >= 0).all():
+            return values[positions]
+        return np.where(positions >= 0, values[positions], fill_value)
+
+
+class ProfileIndex:
+    """Records of each profile ordered by depth, computed once per chunk and
+    shared by the hakai tests rather than sorting and grouping the dataframe
+    within each test.
+
+    A profile regroups the records of a (profile_id, direction_flag) pair,
+    the records without profile_id or direction_flag aren't part of any
+    profile. Records are referred to by position: the index remains valid as
+    long as records aren't added, dropped or reordered.
+
+    Args:
+        df (pd.DataFrame): records to index
+        profile_id, direction_flag, depth_var (str): columns defining the
+            profiles and their vertical coordinate
+
+    Attributes:
+        keys (tuple): indexed (profile_id, direction_flag, depth_var) columns
+        size (int): number of records indexed
+        profile_codes (np.ndarray): position of each record profile_id within
+            profile_ids, -1 if missing
+        profile_ids (np.ndarray): sorted unique profile_id values
+        segments (np.ndarray): profile of each record, -1 if not profiled
+        segment_profiles (np.ndarray): profile_codes of each profile
+        ascending (np.ndarray): positions of the profiled records sorted by
+            profile and ascending depth, missing depths last
+        descending (np.ndarray): same as ascending with descending depths
+        sorted_segments (np.ndarray): profile of each sorted record
+        offsets (np.ndarray): start of each profile within the sorted
+            records followed by the number of profiled records
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        profile_id="hakai_id",
+        direction_flag="direction_flag",
+        depth_var="depth",
+    ):
+        self.keys = (profile_id, direction_flag, depth_var)
+        self.size = len(df)
+        profile_codes, profile_ids = pd.factorize(df[profile_id], sort=True)
+        self.profiles = GroupCodes(
+            profile_codes, pd.Index(profile_ids, name=profile_id)
+        )
+        self.profile_codes, self.profile_ids = profile_codes, profile_ids
+        self._groups = {}
+        direction_codes, directions = pd.factorize(df[direction_flag], sort=True)
+
+        # Sort profiles as groupby(sort=True) on (profile_id, direction_flag)
+        is_profiled = (self.profile_codes >= 0) & (direction_codes >= 0)
+        keys = self.profile_codes * max(len(directions), 1) + direction_codes
+        unique_keys, segments = np.unique(keys[is_profiled], return_inverse=True)
+        self.segments = np.full(self.size, -1)
+        self.segments[is_profiled] = segments
+        self.segment_profiles = unique_keys // max(len(directions), 1)
+
+        # Same order as sort_values([profile_id, direction_flag, depth_var])
+        depth_codes, depths = pd.factorize(df[depth_var], sort=True)
+        is_missing = depth_codes < 0
+        profiled = np.flatnonzero(is_profiled)
+        segments = self.segments[profiled]
+        self.ascending = profiled[
+            np.lexsort(
+                (np.where(is_missing, len(depths), depth_codes)[profiled], segments)
+            )
+        ]
+        self.descending = profiled[
+            np.lexsort(
+                (
+                    np.where(is_missing, len(depths), len(depths) - depth_codes - 1)[
+                        profiled
+                    ],
+                    segments,
+                )
+            )
+        ]
+        self.sorted_segments = self.segments[self.ascending]
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(segments, minlength=len(unique_keys)))]
+        )
+
+    @classmethod
+    def of(
+        cls,
+        df: pd.DataFrame,
+        profile_index=None,
+        profile_id="hakai_id",
+        direction_flag="direction_flag",
+        depth_var="depth",
+    ):
+        """Reuse the given profile index if it indexes the same columns and
+        number of records as the dataframe, otherwise index the dataframe."""
+        if (
+            profile_index is not None
+            and profile_index.keys == (profile_id, direction_flag, depth_var)
+            and profile_index.size == len(df)
+        ):
+            return profile_index
+        return cls(df, profile_id, direction_flag, depth_var)
+
+    def groups(self, df: pd.DataFrame, by: list, dropna=True) -> GroupCodes:
+        """GroupCodes of the indexed records computed once for each group
+        keys, the keys columns are expected to remain unchanged."""
+        key = (tuple(by), dropna)
+        if key not in self._groups:
+            self._groups[key] = GroupCodes.of(df, by, dropna=dropna)
+        return self._groups[key]
+
+    def profile(self, segment: int, descending=False) -> np.ndarray:
+        """Positions of the records of a profile sorted by depth"""
+        order = self.descending if descending else self.ascending
+        return order[self.offsets[segment] : self.offsets[segment + 1]]
+
 
 def do_cap_test(
     df,
@@ -27,6 +206,7 @@ def do_cap_test(
     ratio_above_threshold=0.5,
     minimum_bins_per_profile=10,
     flag_name="_hakai_do_cap_test",
+    profile_index: ProfileIndex = None,
 ):
     """
     Hakai do_cap_test compare down and up cast values measured by an instrument at the same depth. The test compare
@@ -44,6 +224,7 @@ def do_cap_test(
     fail_threshold: suspect threshold value for detection |X_nu - X_nd|
     ratio_above_threshold: minimum threshold of fraction of suspect/fail binned value to consider to flag profile
     minimum_bins_per_profile: minimum amount of bins necessary to make the test usable.
+    profile_index: ProfileIndex of the dataframe shared by the hakai tests
 
     ASSUMPTIONS:
     As of now, the test assume that the input data is already bin averaged for both up or down cast.
@@ -52,63 +233,95 @@ def do_cap_test(
     The test will generate an extra column [var]_do_cap_test with QARTOD flag.
     """
 
-    def _get_do_cap_flag(result):
-        if result["is_missing"] == 1:
-            return QartodFlags.MISSING
-        elif (
-            result["nGoodBinsPerProfile"] < minimum_bins_per_profile
-            or result["is_missing"] + result["is_unknown"] == 1
-        ):
-            return QartodFlags.UNKNOWN
-        elif result["is_fail"] > ratio_above_threshold:
-            return QartodFlags.FAIL
-        elif result["is_suspect"] > ratio_above_threshold:
-            return QartodFlags.SUSPECT
-        return QartodFlags.GOOD
-
     # Handle empty inputs or with no upcast data.
     if var not in df or df[var].isna().all():
         df[var + flag_name] = QartodFlags.MISSING
         return df
 
-    # Bin average average record associated to each profile,direction and bin_id
-    # and then calculate the difference between the two direction
-    profile_bin_stats = (
-        df.assign(bin_id=(df[depth_var] / bin_size).round())
-        .groupby([profile_id, direction_flag, "bin_id"])[var]
+    index = ProfileIndex.of(df, profile_index, profile_id, direction_flag, depth_var)
+
+    # Bin the records of each profile and direction sorted by depth, the
+    # records of each bin are then contiguous
+    bin_id = np.round(df[depth_var].values[index.ascending].astype(float) / bin_size)
+    is_binned = ~np.isnan(bin_id)
+    rows, segments, bin_id = (
+        index.ascending[is_binned],
+        index.sorted_segments[is_binned],
+        bin_id[is_binned],
+    )
+    is_new_bin = np.ones(rows.size, dtype=bool)
+    is_new_bin[1:] = (np.diff(segments) != 0) | (np.diff(bin_id) != 0)
+    bins = np.cumsum(is_new_bin) - 1
+    # Average the records of each bin in their order within the dataframe
+    order = np.lexsort((rows, bins))
+    bin_means = (
+        pd.Series(df[var].values[rows[order]])
+        .groupby(bins[order], sort=False)
         .mean(numeric_only=True)
-        .groupby([profile_id, "bin_id"])
-        .agg([np.ptp, "count"])
+        .values
     )
 
-    # Define missing, unknown, suspect and missing values from bin statistics
-    profile_bin_stats = profile_bin_stats.assign(
-        is_missing=profile_bin_stats["ptp"].isnull()
-        & (profile_bin_stats["count"] == 0),
-        is_unknown=profile_bin_stats["count"] == 1,
-        is_suspect=(profile_bin_stats["ptp"] > suspect_threshold)
-        & (profile_bin_stats["count"] > 1),
-        is_fail=(profile_bin_stats["ptp"] > fail_threshold)
-        & (profile_bin_stats["count"] > 1),
+    # Regroup the bins of both directions of each profile and calculate the
+    # difference between the two directions
+    bin_profiles = index.segment_profiles[segments[is_new_bin]]
+    bin_id = bin_id[is_new_bin]
+    order = np.lexsort((bin_id, bin_profiles))
+    bin_profiles, bin_id, bin_means = (
+        bin_profiles[order],
+        bin_id[order],
+        bin_means[order],
     )
-
-    # Get each flag ratio per profile
-    profile_stats = profile_bin_stats.groupby(by=[profile_id]).agg(
-        lambda x: sum(x) / len(x)
+    starts = np.flatnonzero(
+        np.diff(bin_profiles, prepend=-1) | (np.diff(bin_id, prepend=np.nan) != 0)
     )
-    profile_stats["nBinsPerProfile"] = profile_bin_stats.groupby(by=[profile_id])[
-        "count"
-    ].count()
-    profile_stats["nGoodBinsPerProfile"] = (
-        profile_bin_stats.query("ptp>0")["ptp"].groupby("hakai_id").count()
+    ptp = np.maximum.reduceat(bin_means, starts) - np.minimum.reduceat(
+        bin_means, starts
     )
+    count = np.add.reduceat(~np.isnan(bin_means), starts)
+
+    # Define missing, unknown, suspect and missing values from bin statistics
+    with np.errstate(invalid="ignore"):
+        bin_stats = {
+            "is_missing": np.isnan(ptp) & (count == 0),
+            "is_unknown": count == 1,
+            "is_suspect": (ptp > suspect_threshold) & (count > 1),
+            "is_fail": (ptp > fail_threshold) & (count > 1),
+            "is_good": ptp > 0,
+        }
+
+    # Get each flag ratio per profile
+    profiles = bin_profiles[starts]
+    profile_starts = np.flatnonzero(np.diff(profiles, prepend=-1))
+    n_bins = np.diff(np.append(profile_starts, profiles.size))
+    n_good_bins = np.add.reduceat(bin_stats.pop("is_good"), profile_starts)
+    ratios = {
+        name: np.add.reduceat(values, profile_starts) / n_bins
+        for name, values in bin_stats.items()
+    }
 
     # Generate quartod flag
-    profile_stats[var + flag_name] = profile_stats.apply(
-        _get_do_cap_flag, axis="columns"
+    profile_flags = np.select(
+        [
+            ratios["is_missing"] == 1,
+            ((n_good_bins > 0) & (n_good_bins < minimum_bins_per_profile))
+            | (ratios["is_missing"] + ratios["is_unknown"] == 1),
+            ratios["is_fail"] > ratio_above_threshold,
+            ratios["is_suspect"] > ratio_above_threshold,
+        ],
+        [
+            QartodFlags.MISSING,
+            QartodFlags.UNKNOWN,
+            QartodFlags.FAIL,
+            QartodFlags.SUSPECT,
+        ],
+        default=QartodFlags.GOOD,
     )
 
-    return df.merge(profile_stats[var + flag_name], how="left", on="hakai_id")
+    # Apply each profile flag to its records
+    df[var + flag_name] = index.profiles.broadcast(
+        profile_flags, profiles[profile_starts]
+    )
+    return df
 
 
 def bottom_hit_detection(
@@ -118,36 +331,44 @@ def bottom_hit_detection(
     depth_variable="depth",
     profile_direction_variable="direction_flag",
     flag_column_name="bottom_hit_test",
+    profile_index: ProfileIndex = None,
 ):
     """
     Method that flag consecutive data near the bottom of a profile that was flagged SUSPECT=3 or FAIl=4. Output a
     'bottom_hit_flag' channel.
     """
+    index = ProfileIndex.of(
+        df, profile_index, profile_id, profile_direction_variable, depth_variable
+    )
+    flags = np.full(len(df), QartodFlags.GOOD)
+    if index.ascending.size == 0:
+        df[flag_column_name] = flags
+        return df
+
+    # Records of each profile sorted by depth
+    values = df[variables].values[index.ascending]
+    depth = df[depth_variable].values[index.ascending].astype(float)
+    starts = index.offsets[:-1]
 
     # For each profile (down and up cast), get the density flag value for the deepest record.
     #  If flagged [3,4], it has likely hit the bottom.
-    df[flag_column_name] = QartodFlags.GOOD
-
-    bottom_hit_id = (
-        df.sort_values(by=[profile_id, profile_direction_variable, depth_variable])
-        .groupby(by=[profile_id, profile_direction_variable])
-        .last()[variables]
-        .isin([QartodFlags.SUSPECT, QartodFlags.FAIL])
+    last_valid = np.maximum.reduceat(
+        np.where(pd.notna(values), np.arange(values.size), -1), starts
+    )
+    is_bottom_hit = (last_valid >= 0) & np.isin(
+        values[last_valid], [QartodFlags.SUSPECT, QartodFlags.FAIL]
     )
+    # Both directions of the profiles hitting the bottom are reviewed
+    is_reviewed = np.isin(index.segment_profiles, index.segment_profiles[is_bottom_hit])
 
     # Now let's flag the consecutive data that are flagged in sigma0 near the bottom as bottom hit
-    for hakai_id in bottom_hit_id[bottom_hit_id].reset_index()[profile_id]:
-        for _, df_bottom_hit in df[df[profile_id] == hakai_id].groupby(
-            by=[profile_id, profile_direction_variable]
-        ):
-            # For each bottom hit find the deepest good record in density and flag everything else below as FAIL
-            df.loc[
-                df_bottom_hit[
-                    df_bottom_hit[depth_variable]
-                    > df_bottom_hit[df_bottom_hit[variables] == 1][depth_variable].max()
-                ].index,
-                flag_column_name,
-            ] = QartodFlags.FAIL
+    # For each bottom hit find the deepest good record in density and flag everything else below as FAIL
+    deepest_good = np.fmax.reduceat(np.where(values == 1, depth, np.nan), starts)
+    is_below = depth > np.repeat(deepest_good, np.diff(index.offsets))
+    flags[index.ascending[is_below & is_reviewed[index.sorted_segments]]] = (
+        QartodFlags.FAIL
+    )
+    df[flag_column_name] = flags
     return df
 
 
@@ -159,6 +380,7 @@ def par_shadow_test(
     direction_flag="direction_flag",
     depth_var="depth",
     flag_column_name="par_shadow_test",
+    profile_index: ProfileIndex = None,
 ):
     """
     The PAR shadow test assume that PAR values should always be increasing with shallower depths. The tool first
@@ -170,53 +392,183 @@ def par_shadow_test(
     if df[variable].isna().all():
         df[flag_column_name] = QartodFlags.UNKNOWN
     else:
-        df["par_cummax"] = (
-            df.sort_values(by=[profile_id, direction_flag, depth_var], ascending=False)
-            .groupby(by=[profile_id, direction_flag])[variable]
+        index = ProfileIndex.of(
+            df, profile_index, profile_id, direction_flag, depth_var
+        )
+        par_cummax = np.full(len(df), np.nan)
+        par_cummax[index.descending] = (
+            pd.Series(df[variable].values[index.descending])
+            .groupby(index.sorted_segments)
             .cummax()
+            .values
         )
 
         df[flag_column_name] = QartodFlags.GOOD
         df.loc[
-            (df[variable] < df["par_cummax"])
-            & (df["par_cummax"] > min_par_for_shadow_detection),
+            (df[variable] < par_cummax) & (par_cummax > min_par_for_shadow_detection),
             flag_column_name,
         ] = QartodFlags.SUSPECT
-        df.drop("par_cummax", axis=1, inplace=True)
+        # Casts without any PAR value are not tested, independently of the
+        # other casts processed with them
+        is_untested = (
+            df[variable].isna().groupby(df[profile_id], dropna=False).transform("all")
+        )
+        df.loc[is_untested, flag_column_name] = QartodFlags.UNKNOWN
     return df
 
 
+def is_bad_value(values, bad_value=SEABIRD_BAD_VALUE, rtol=BAD_VALUE_RTOL):
+    """Compare float values with a bad value within a relative tolerance, so
+    that bad values altered by float conversions are still detected."""
+    return np.abs(np.asarray(values, dtype=float) - bad_value) <= abs(bad_value) * rtol
+
+
+# Inferred types of the object columns which may hold numeric values
+NUMERIC_INFERRED_TYPES = (
+    "integer",
+    "floating",
+    "mixed-integer",
+    "mixed-integer-float",
+    "mixed",
+)
+
+
+def _bad_value_mask(
+    values: pd.Series, bad_value=SEABIRD_BAD_VALUE, rtol=BAD_VALUE_RTOL
+) -> np.ndarray:
+    """is_bad_value of a column of any dtype: the numeric values are compared
+    within the relative tolerance, other values (ex: strings) never match."""
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return np.zeros(len(values), dtype=bool)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return is_bad_value(
+            values.to_numpy(dtype=float, na_value=np.nan), bad_value, rtol
+        )
+    is_bad = np.zeros(len(values), dtype=bool)
+    if (
+        values.dtype != object
+        or pd.api.types.infer_dtype(values, skipna=True) not in NUMERIC_INFERRED_TYPES
+    ):
+        return is_bad
+    is_number = np.array(
+        [
+            isinstance(value, (int, float, np.integer, np.floating))
+            and not isinstance(value, bool)
+            for value in values
+        ],
+        dtype=bool,
+    )
+    is_bad[is_number] = is_bad_value(
+        values[is_number].to_numpy(dtype=float), bad_value, rtol
+    )
+    return is_bad
+
+
+def _bad_value_levels(flag_mapping):
+    """Split the values of each flag level into missing values and the
+    other values compared with the records."""
+    levels = []
+    for level, values in flag_mapping.items():
+        is_na_values = [
+            value
+            for value in values
+            if pd.isna(value) or value in [".isna", "NaN", "nan"]
+        ]
+        if is_na_values:
+            values = set(values).difference(is_na_values)
+        levels.append((QartodFlags.__dict__[level], bool(is_na_values), list(values)))
+    return levels
+
+
 def bad_value_test(
-    df, variables, flag_mapping=None, flag_column_suffix="_hakai_bad_value_test"
+    df,
+    variables,
+    flag_mapping=None,
+    flag_column_suffix="_hakai_bad_value_test",
+    drop_bad_values=False,
 ):
     """
     Find Flag values present in the data, attach a given QARTOD Flag to them and replace them by NaN.
+
+    The float columns are scanned at once. Numeric values of every column,
+    including object columns, are compared with the flag values within
+    BAD_VALUE_RTOL, while strings never match a numeric flag value. If
+    drop_bad_values, the Seabird bad values and missing values of every
+    column are also replaced by NaN.
     """
     # Default Hakai Bad data
     if flag_mapping is None:
-        flag_mapping = {"MISSING": [np.nan, pd.NA], "FAIL": [-9.99e-29]}
+        flag_mapping = {"MISSING": [np.nan, pd.NA], "FAIL": [SEABIRD_BAD_VALUE]}
+    if isinstance(variables, str):
+        variables = [variables]
+    levels = _bad_value_levels(flag_mapping)
+
+    # Single scan of the float columns
+    float_columns = [
+        column for column, dtype in df.dtypes.items() if dtype == np.float64
+    ]
+    scanned = (
+        float_columns
+        if drop_bad_values
+        else [column for column in variables if column in set(float_columns)]
+    )
+    block = df[scanned].to_numpy(dtype=float)
+    positions = {column: position for position, column in enumerate(scanned)}
+    scanned_variables = [column for column in variables if column in positions]
+    values = block[:, [positions[column] for column in scanned_variables]]
+    scanned_flags = np.full(values.shape, QartodFlags.GOOD)
+    for flag, has_na_values, level_values in levels:
+        is_flagged = np.isnan(values) if has_na_values else np.zeros_like(values, bool)
+        for value in level_values:
+            if isinstance(value, numbers.Number):
+                is_flagged |= is_bad_value(values, value)
+        scanned_flags[is_flagged] = flag
 
     for column in variables:
-        # Assign everything as good first
         logger.debug("Generate flag column: {}{}", column, flag_column_suffix)
-        df[column + flag_column_suffix] = QartodFlags.GOOD
-        for level, values in flag_mapping.items():
-            is_na_values = [
-                value
-                for value in values
-                if pd.isna(value) or value in [".isna", "NaN", "nan"]
-            ]
-            if any(is_na_values):
-                df.loc[df[column].isna(), column + flag_column_suffix] = (
-                    QartodFlags.__dict__[level]
-                )
-                values = set(values).difference(is_na_values)
-            df.loc[df[column].isin(values), column + flag_column_suffix] = (
-                QartodFlags.__dict__[level]
-            )
+        if column in positions:
+            flags = scanned_flags[:, scanned_variables.index(column)]
+        else:
+            flags = _bad_value_flags(df[column], levels)
+        df[column + flag_column_suffix] = flags
+
+    if drop_bad_values:
+        # Replace the bad values by NaN within the float columns that have any
+        is_dropped = is_bad_value(block)
+        for position in np.flatnonzero(is_dropped.any(axis=0)):
+            column_values = block[:, position]
+            column_values[is_dropped[:, position]] = np.nan
+            df[scanned[position]] = column_values
+        others = [
+            column
+            for column, dtype in df.dtypes.items()
+            if dtype == object or isinstance(dtype, pd.api.extensions.ExtensionDtype)
+        ]
+        if others:
+            df[others] = df[others].replace({value: np.nan for value in [None, pd.NA]})
+            for column in others:
+                is_dropped = _bad_value_mask(df[column])
+                if is_dropped.any():
+                    df.loc[is_dropped, column] = np.nan
     return df
 
 
+def _bad_value_flags(values: pd.Series, levels: list) -> np.ndarray:
+    flags = np.full(len(values), QartodFlags.GOOD)
+    for flag, has_na_values, level_values in levels:
+        if has_na_values:
+            flags[values.isna().values] = flag
+        other_values = []
+        for value in level_values:
+            if isinstance(value, numbers.Number):
+                flags[_bad_value_mask(values, value)] = flag
+            else:
+                other_values.append(value)
+        if other_values:
+            flags[values.isin(other_values).values] = flag
+    return flags
+
+
 def load_grey_list(path):
     return pd.read_csv(
         path,
@@ -232,6 +584,54 @@ def load_grey_list(path):
     ).replace({pd.NA: None})
 
 
+# Grey list queries are appended to the entry conditions: " and par > 1"
+GREY_LIST_QUERY_CONJUNCTION = re.compile(r"^\s*(and\b|&)")
+
+
+class GreyListIndex:
+    """Index of the records of each instrument (device_model, device_sn)
+    sorted by measurement time, used to retrieve the records measured within
+    a time range by binary search.
+
+    The time range bounds are compared with the measurement_dt values like
+    a pandas query would: as timestamps if measurement_dt is a datetime and
+    as strings otherwise.
+    """
+
+    def __init__(self, df, time_variable="measurement_dt"):
+        times = df[time_variable]
+        self.is_datetime = pd.api.types.is_datetime64_any_dtype(times)
+        self.instruments = {}
+        for instrument, rows in df.groupby(
+            ["device_model", "device_sn"], sort=False
+        ).indices.items():
+            rows = rows[times.iloc[rows].notna().to_numpy()]
+            instrument_times = pd.Index(times.iloc[rows])
+            order = instrument_times.argsort(kind="stable")
+            self.instruments[instrument] = (instrument_times[order], rows[order])
+
+    def find(self, device_model, device_sn, start, end) -> np.ndarray:
+        """Retrieve the positions of an instrument records measured between
+        start and end (inclusive)."""
+        if (device_model, device_sn) not in self.instruments:
+            return np.array([], dtype=int)
+        times, rows = self.instruments[(device_model, device_sn)]
+        if not self.is_datetime:
+            start, end = str(start), str(end)
+        return np.sort(
+            rows[times.searchsorted(start, "left") : times.searchsorted(end, "right")]
+        )
+
+
+def _append_description(descriptions: pd.Series, description: str) -> pd.Series:
+    """Append a description to existing flag descriptions"""
+    result = pd.Series(description, index=descriptions.index, dtype=object)
+    has_description = descriptions.notna()
+    if has_description.any():
+        result[has_description] = descriptions[has_description] + "; " + description
+    return result
+
+
 def grey_list(
     df,
     df_grey_list,
@@ -239,27 +639,31 @@ def grey_list(
     level2_flag_suffix="_flag",
     grey_list_suffix="_grey_list_test",
 ):
-    # Loop through each lines
-    # Since the grey list is a manual input it will likely be small amount and looping through
-    # each should be good enough for now. We may have to filter the grey list based on the input in the future
-    # if the grey list becomes significant.
+    # Index the records of each instrument by time once, so that each grey
+    # list entry only retrieves its instrument records within its time range
+    index = GreyListIndex(df)
     for _, row in df_grey_list.iterrows():
-        # Generate Grey List Entry Query
-        # Mandatory fields
-        query_string = f"'{row['start_datetime_range']}' <= measurement_dt <= '{row['end_datetime_range']}'"
-        query_string += f" and device_model=='{row['device_model']}'"
-        query_string += f" and device_sn=='{row['device_sn']}'"
-        # Optional Fields
-        if row["hakai_id"]:
-            query_string += f" and hakai_id in ({row['hakai_id'].split(',')})"
-        if row["query"]:
-            query_string += row["query"]
-
         # Find matching data
-        df_to_flag = df.query(query_string)
+        rows = index.find(
+            str(row["device_model"]),
+            str(row["device_sn"]),
+            row["start_datetime_range"],
+            row["end_datetime_range"],
+        )
+        if row["hakai_id"] and len(rows) > 0:
+            rows = rows[
+                df["hakai_id"].iloc[rows].isin(row["hakai_id"].split(",")).to_numpy()
+            ]
+        if row["query"] and len(rows) > 0:
+            # The query only filters the records matching the entry
+            predicate = compile_predicate(
+                GREY_LIST_QUERY_CONJUNCTION.sub("", row["query"])
+            )
+            rows = rows[predicate(df.iloc[rows]).to_numpy(dtype=bool)]
+        flagged_index = df.index[rows]
 
         # If some data needs to be flagged
-        if len(df_to_flag) > 0:
+        if len(flagged_index) > 0:
             # Review if the columns exist
             unknown_variables = [
                 var for var in row["data_type"].split(",") if var not in df.columns
@@ -289,10 +693,10 @@ def grey_list(
                     df[var] = QartodFlags.GOOD
 
             # Add a grey list test variable for helping review
-            df.loc[df_to_flag.index, grey_list_test_columns] = row["flag_type"]
+            df.loc[flagged_index, grey_list_test_columns] = row["flag_type"]
 
             # Overwrite Hakai QARTOD Flag
-            df.loc[df_to_flag.index, qartod_columns] = row["flag_type"]
+            df.loc[flagged_index, qartod_columns] = row["flag_type"]
 
             # Append to description Flag Comment and name
             grey_flag_comment = row.comments + (
@@ -302,14 +706,8 @@ def grey_list(
             for column in flag_descriptor_columns:
                 if column not in df:
                     df[column] = ""
-                df.loc[df_to_flag.index, column] = df.loc[
-                    df_to_flag.index, column
-                ].apply(
-                    lambda x: (
-                        x + "; " + grey_flag_description
-                        if pd.notna(x)
-                        else grey_flag_description
-                    )
+                df.loc[flagged_index, column] = _append_description(
+                    df.loc[flagged_index, column], grey_flag_description
                 )
     return df
 
@@ -323,66 +721,54 @@ def hakai_station_maximum_depth_test(
     fail_exceedance_percentage=None,
     suspect_exceedance_range=None,
     fail_exceedance_range=None,
+    profile_index: ProfileIndex = None,
 ):
     """
     This test review each profile maximum depth by profile identifier
     and compare it to the station depth. The whole profile
     gets flagged as suspect/fail if the maximum depth exceed a percentage
-    or range above of the station depth.
+    or range above of the station depth. Profiles without station are
+    flagged as UNKNOWN.
     """
+    by = ["station", "hakai_id"]
+    if profile_index is not None and profile_index.size == len(df):
+        groups = profile_index.groups(df, by, dropna=False)
+    else:
+        groups = GroupCodes.of(df, by, dropna=False)
+
     # Get Maximum Depth per profile
-    df_max_depth = (
-        df.groupby(["station", "hakai_id"])[variable]
-        .max()
-        .rename("max_depth")
-        .to_frame()
+    max_depth = (
+        pd.Series(df[variable].values).groupby(groups.codes).max().values.astype(float)
     )
 
     # Join Maximum Depth With station information
-    df_max_depth = df_max_depth.reset_index().merge(
-        hakai_stations[["station", "station_depth"]],
-        how="left",
-        on="station",
+    station_depth = (
+        hakai_stations.drop_duplicates("station")
+        .set_index("station")["station_depth"]
+        .reindex(groups.keys.get_level_values("station"))
+        .values.astype(float)
     )
 
     # Start with Flag GOOD
-    df_max_depth[flag_column] = QartodFlags.GOOD
+    flags = np.full(len(max_depth), QartodFlags.GOOD)
 
     # If station is depth is unknown flag unkown
-    df_max_depth.loc[df_max_depth["station_depth"].isnull(), flag_column] = (
-        QartodFlags.UNKNOWN
-    )
+    flags[np.isnan(station_depth)] = QartodFlags.UNKNOWN
 
     # SUSPECT Flag
-    df_max_depth.loc[
-        (
-            df_max_depth["max_depth"]
-            > df_max_depth["station_depth"] * suspect_exceedance_percentage
-        )
-        & (
-            df_max_depth["max_depth"]
-            > df_max_depth["station_depth"] + suspect_exceedance_range
-        ),
-        flag_column,
+    flags[
+        (max_depth > station_depth * suspect_exceedance_percentage)
+        & (max_depth > station_depth + suspect_exceedance_range)
     ] = QartodFlags.SUSPECT
 
     # Fail Flag
-    df_max_depth.loc[
-        (
-            df_max_depth["max_depth"]
-            > df_max_depth["station_depth"] * fail_exceedance_percentage
-        )
-        & (
-            df_max_depth["max_depth"]
-            > df_max_depth["station_depth"] + fail_exceedance_range
-        ),
-        flag_column,
+    flags[
+        (max_depth > station_depth * fail_exceedance_percentage)
+        & (max_depth > station_depth + fail_exceedance_range)
     ] = QartodFlags.FAIL
 
-    return df.merge(
-        df_max_depth.reset_index()[["station", "hakai_id", flag_column]],
-        on=["station", "hakai_id"],
-    )
+    df[flag_column] = groups.broadcast(flags)
+    return df
 
 
 def query_based_flag_test(df: pd.DataFrame, query_list: list):
@@ -392,70 +778,99 @@ def query_based_flag_test(df: pd.DataFrame, query_list: list):
         df: dataframe of the data
         query_list: list of query objects ->
             {
-                "query": run by pandas query,
+                "query": pandas query expression, compiled once,
                 "flag_value": QARTOD value,
                 "flag_columns": list of column names to generate
             }
     Output:  dataframe
     """
+    predicates = [compile_predicate(query["query"]) for query in query_list]
+    missing = frozenset().union(
+        *(predicate.missing_columns(df.columns) for predicate in predicates)
+    )
+    if missing:
+        raise KeyError(f"Columns {sorted(missing)} used by query_based_flag missing")
 
-    for query in query_list:
+    for query, predicate in zip(query_list, predicates):
         for flag_column in query["flag_columns"]:
             if flag_column not in df:
                 df[flag_column] = 1  # GOOD
 
-        df.loc[df.query(query["query"]).index, query["flag_columns"]] = query[
-            "flag_value"
-        ]
+        df.loc[predicate(df), list(query["flag_columns"])] = query["flag_value"]
 
     return df
 
 
-def apply_flag_from_process_log(df, metadata):
+class ProcessLogRule(NamedTuple):
+    """Flag SUSPECT the columns of the casts whose processing log matches
+    a pattern."""
+
+    pattern: re.Pattern
+    columns: tuple
+    static_casts: bool = True
+
+
+PROCESS_LOG_WARNING = re.compile("warning", re.IGNORECASE)
+PROCESS_LOG_RULES = (
+    ProcessLogRule(
+        re.compile(
+            re.escape(
+                "WARNING!!! Slower Oxygen Sensor RBR CODAstandard are not "
+                "recommended for profiling applications."
+            )
+        ),
+        ("dissolved_oxygen_ml_l_hakai_slow_oxygen_sensor_test",),
+        static_casts=False,
+    ),
+    ProcessLogRule(
+        re.compile(re.escape("WARNING! NO SOAK DETECTED, SUSPICIOUS DATA QUALITY")),
+        (
+            "dissolved_oxygen_ml_l_hakai_no_soak_test",
+            "temperature_hakai_no_soak_test",
+            "conductivity_hakai_no_soak_test",
+            "salinity_hakai_no_soak_test",
+        ),
+    ),
+    ProcessLogRule(
+        re.compile(
+            re.escape(
+                "Static Measurement is considered SUSPICIOUS due to the lowered "
+                "thredholds"
+            )
+        ),
+        ("hakai_short_static_deployment_test",),
+    ),
+)
+
+
+def apply_flag_from_process_log(df, metadata, rules=PROCESS_LOG_RULES):
     """
     Apply flag from processing log to the dataframe respective variables
+
+    The processing log of each cast is classified once with the rules, the
+    flags are then applied to the records of all the flagged casts at once.
     """
-    for _, cast in metadata.iterrows():
-        if not cast["process_log"] or not re.search(
-            "warning", cast["process_log"], re.IGNORECASE
-        ):
+    # Columns flagged for each cast, in the order the columns are generated
+    flagged_casts = {}
+    for hakai_id, process_log, cast_type in zip(
+        metadata["hakai_id"], metadata["process_log"], metadata["cast_type"]
+    ):
+        if not process_log or not PROCESS_LOG_WARNING.search(process_log):
             continue
+        for rule in rules:
+            if rule.pattern.search(process_log) and (
+                rule.static_casts or cast_type != "Static"
+            ):
+                for column in rule.columns:
+                    flagged_casts.setdefault(column, set()).add(hakai_id)
+    if not flagged_casts:
+        return df
 
-        if (
-            "WARNING!!! Slower Oxygen Sensor RBR CODAstandard are not recommended for profiling applications."
-            in cast["process_log"]
-            and cast["cast_type"] != "Static"
-        ):
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"],
-                "dissolved_oxygen_ml_l_hakai_slow_oxygen_sensor_test",
-            ] = 3
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"],
-                "dissolved_oxygen_ml_l_hakai_slow_oxygen_sensor_test",
-            ] = 3
-
-        if "WARNING! NO SOAK DETECTED, SUSPICIOUS DATA QUALITY" in cast["process_log"]:
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"],
-                "dissolved_oxygen_ml_l_hakai_no_soak_test",
-            ] = 3
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"], "temperature_hakai_no_soak_test"
-            ] = 3
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"], "conductivity_hakai_no_soak_test"
-            ] = 3
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"], "salinity_hakai_no_soak_test"
-            ] = 3
-
-        if (
-            "Static Measurement is considered SUSPICIOUS due to the lowered thredholds"
-            in cast["process_log"]
-        ):
-            df.loc[
-                df["hakai_id"] == cast["hakai_id"], "hakai_short_static_deployment_test"
-            ] = 3
-
+    # Map each record to its cast and broadcast the cast flags
+    hakai_ids = pd.Index(set().union(*flagged_casts.values()))
+    casts = hakai_ids.get_indexer(df["hakai_id"])
+    for column, column_casts in flagged_casts.items():
+        # The last item is retrieved by the records of casts not flagged
+        is_flagged = np.append(hakai_ids.isin(list(column_casts)), False)
+        df.loc[is_flagged[casts], column] = 3
     return df
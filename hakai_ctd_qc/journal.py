@@ -0,0 +1,121 @@
+"""Journal
+Record within a local SQLite database the progress of each cast qced
+during a run, so that an interrupted run can be resumed where it stopped.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from loguru import logger
+
+DEFAULT_JOURNAL_PATH = "ctd_qc_journal.sqlite"
+# Casts which failed to be retrieved or qced are recorded as failed and
+# retried by a resumed run
+STAGES = ("pending", "failed", "fetched", "qced", "uploaded")
+
+
+def hash_items(*items) -> str:
+    """Generate a stable sha256 hash of json serializable items."""
+    return hashlib.sha256(
+        json.dumps(items, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class Journal:
+    """Journal of the casts processed by runs sharing the same run_key.
+
+    Each cast is recorded with the latest stage reached: pending, failed,
+    fetched, qced or uploaded. The run_key should identify the cast selection, the qc
+    configuration and the package version, so that a resumed run never skips
+    casts that were processed with a different configuration.
+
+    Args:
+        path (str): path to the SQLite database
+        run_key (str): identifier of the run
+        metadata (dict): information about the run saved alongside the run_key
+    """
+
+    def __init__(self, path: str, run_key: str, metadata: dict = None):
+        self.path = path
+        self.run_key = run_key
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_key TEXT PRIMARY KEY, metadata TEXT, started_at TEXT)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS casts ("
+                "run_key TEXT, ctd_cast_pk INTEGER, hakai_id TEXT, stage TEXT, "
+                "updated_at TEXT, PRIMARY KEY (run_key, ctd_cast_pk))"
+            )
+            self.connection.execute(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?, ?)",
+                (run_key, json.dumps(metadata, default=str), _now()),
+            )
+        logger.info("Journal run {} in {}", run_key, path)
+
+    def record(self, stage: str, casts: list):
+        """Record the stage reached by the given casts.
+
+        A cast is never moved back to a previous stage.
+
+        Args:
+            stage (str): stage reached
+            casts (list): list of (ctd_cast_pk, hakai_id)
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown journal stage {stage}. Must be one of {STAGES}")
+        rank = STAGES.index(stage)
+        now = _now()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO casts VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_key, ctd_cast_pk) DO UPDATE SET "
+                "stage=excluded.stage, updated_at=excluded.updated_at "
+                "WHERE ? > (CASE casts.stage "
+                + " ".join(f"WHEN '{name}' THEN {i}" for i, name in enumerate(STAGES))
+                + " ELSE -1 END)",
+                [
+                    (self.run_key, int(ctd_cast_pk), hakai_id, stage, now, rank)
+                    for ctd_cast_pk, hakai_id in casts
+                ],
+            )
+
+    def stages(self) -> dict:
+        """Retrieve the latest stage reached by each cast of the run.
+
+        Returns:
+            dict: {ctd_cast_pk: stage}
+        """
+        with self._lock:
+            return dict(
+                self.connection.execute(
+                    "SELECT ctd_cast_pk, stage FROM casts WHERE run_key=?",
+                    (self.run_key,),
+                ).fetchall()
+            )
+
+    def completed(self, stage: str) -> set:
+        """Retrieve the casts that reached at least the given stage.
+
+        Returns:
+            set: ctd_cast_pk
+        """
+        rank = STAGES.index(stage)
+        return {
+            ctd_cast_pk
+            for ctd_cast_pk, cast_stage in self.stages().items()
+            if STAGES.index(cast_stage) >= rank
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,233 @@
+"""Predicates
+Boolean expressions written with the pandas query syntax compiled once into
+predicates reused by every chunk. Each expression is parsed a single time,
+the columns it reads are known before evaluating it and numeric expressions
+are evaluated with numexpr when it is installed.
+"""
+
+import ast
+import io
+import tokenize
+from functools import lru_cache, reduce
+
+import numpy as np
+import pandas as pd
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+LOCAL_PREFIX = "__local_"
+NUMEXPR_NODES = (
+    ast.Expression,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Compare,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.Pow,
+    ast.Mod,
+    ast.BitAnd,
+    ast.BitOr,
+    ast.Invert,
+    ast.USub,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+)
+
+
+def _isin(values, candidates):
+    if isinstance(values, pd.Series):
+        return values.isin(candidates)
+    return candidates.isin(values)
+
+
+def _as_mask(result, df):
+    if isinstance(result, pd.Series):
+        return result
+    return pd.Series(np.full(len(df), result), index=df.index)
+
+
+def _rewrite_tokens(expression: str) -> str:
+    """Replace the pandas specific tokens: `&` and `|` have the precedence
+    of `and` and `or` and `@name` refers to a local variable."""
+    tokens = []
+    is_local = False
+    for token in tokenize.generate_tokens(io.StringIO(expression).readline):
+        kind, string = token.type, token.string
+        if kind == tokenize.ERRORTOKEN and string.strip():
+            raise ValueError(f"Unsupported token {string!r} in {expression!r}")
+        if kind == tokenize.OP and string == "@":
+            is_local = True
+            continue
+        if is_local:
+            if kind != tokenize.NAME:
+                raise ValueError(f"Invalid local variable in {expression!r}")
+            kind, string, is_local = kind, LOCAL_PREFIX + string, False
+        elif kind == tokenize.OP and string in ("&", "|"):
+            kind, string = tokenize.NAME, "and" if string == "&" else "or"
+        tokens.append((kind, string))
+    return tokenize.untokenize(tokens)
+
+
+class _Elementwise(ast.NodeTransformer):
+    """Convert the boolean operators and comparisons to their elementwise
+    counterpart as pandas query does."""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        return reduce(lambda left, right: ast.BinOp(left, op, right), node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(ast.Invert(), node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        comparisons = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            comparisons.append(self._compare(left, op, right))
+            left = right
+        return reduce(
+            lambda left, right: ast.BinOp(left, ast.BitAnd(), right), comparisons
+        )
+
+    @staticmethod
+    def _compare(left, op, right):
+        is_list = isinstance(right, (ast.List, ast.Tuple)) or isinstance(
+            left, (ast.List, ast.Tuple)
+        )
+        if isinstance(op, (ast.In, ast.NotIn)) or (
+            is_list and isinstance(op, (ast.Eq, ast.NotEq))
+        ):
+            isin = ast.Call(ast.Name("_isin", ast.Load()), [left, right], [])
+            if isinstance(op, (ast.In, ast.Eq)):
+                return isin
+            return ast.UnaryOp(ast.Invert(), isin)
+        return ast.Compare(left, [op], [right])
+
+
+class Predicate:
+    """Boolean expression over the columns of a dataframe written with the
+    pandas query syntax.
+
+    Calling the predicate on a dataframe returns the same boolean mask as
+    `df.eval(expression)`, so that `df.loc[predicate(df)]` is equivalent to
+    `df.query(expression)`.
+
+    Args:
+        expression (str): pandas query expression
+
+    Attributes:
+        columns (frozenset): columns read by the expression
+        local_variables (frozenset): variables referred to with `@name`
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        try:
+            tree = ast.parse(_rewrite_tokens(expression).strip(), mode="eval")
+        except (SyntaxError, tokenize.TokenError) as error:
+            raise ValueError(f"Invalid expression {expression!r}: {error}") from error
+        tree = ast.fix_missing_locations(_Elementwise().visit(tree))
+
+        names = {
+            node.id
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and node.id != "_isin"
+        }
+        self.local_variables = frozenset(
+            name[len(LOCAL_PREFIX) :] for name in names if name.startswith(LOCAL_PREFIX)
+        )
+        self.columns = frozenset(
+            name for name in names if not name.startswith(LOCAL_PREFIX)
+        )
+        self._code = compile(tree, f"<predicate {expression!r}>", "eval")
+        self._numexpr = (
+            ast.unparse(tree)
+            if all(isinstance(node, NUMEXPR_NODES) for node in ast.walk(tree))
+            else None
+        )
+
+    def __repr__(self):
+        return f"Predicate({self.expression!r})"
+
+    def missing_columns(self, columns) -> frozenset:
+        """Columns read by the expression which aren't in the given columns"""
+        return self.columns - frozenset(columns)
+
+    def _evaluate_numexpr(self, df, local_variables):
+        if numexpr is None or self._numexpr is None:
+            return None
+        arrays = {column: df[column] for column in self.columns}
+        if not all(
+            isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf"
+            for values in arrays.values()
+        ):
+            return None
+        values = {column: values.to_numpy() for column, values in arrays.items()}
+        for name, value in local_variables.items():
+            if np.asarray(value).dtype.kind not in "biuf":
+                return None
+            values[LOCAL_PREFIX + name] = value
+        try:
+            result = numexpr.evaluate(self._numexpr, local_dict=values)
+        except (NotImplementedError, TypeError, ValueError, KeyError):
+            return None
+        return _as_mask(result if result.ndim else result.item(), df)
+
+    def __call__(self, df: pd.DataFrame, **local_variables) -> pd.Series:
+        """Evaluate the expression on a dataframe.
+
+        Args:
+            df (pd.DataFrame): dataframe including the columns read
+            **local_variables: values of the variables referred to with `@name`
+
+        Returns:
+            pd.Series: boolean mask of the matching records
+        """
+        missing = self.missing_columns(df.columns)
+        if missing:
+            raise KeyError(
+                f"Columns {sorted(missing)} used by {self.expression!r} "
+                "aren't in the dataframe"
+            )
+        missing = self.local_variables - set(local_variables)
+        if missing:
+            raise NameError(
+                f"Local variables {sorted(missing)} used by {self.expression!r} "
+                "aren't defined"
+            )
+        local_variables = {name: local_variables[name] for name in self.local_variables}
+
+        result = self._evaluate_numexpr(df, local_variables)
+        if result is not None:
+            return result
+
+        namespace = {
+            "__builtins__": {},
+            "_isin": _isin,
+            **{column: df[column] for column in self.columns},
+            **{LOCAL_PREFIX + name: value for name, value in local_variables.items()},
+        }
+        return _as_mask(eval(self._code, namespace), df)
+
+
+@lru_cache(maxsize=None)
+def compile_predicate(expression: str) -> Predicate:
+    """Compile a pandas query expression once and reuse it afterwards."""
+    return Predicate(expression)
@@ -0,0 +1,345 @@
+"""QARTOD Batch
+Run the QARTOD tests of an ioos_qc configuration over all the profiles of a
+chunk at once rather than building an ioos_qc PandasStream for each profile.
+
+The profiles are concatenated into segmented arrays: each test is applied to
+the whole array with the same numpy operations as ioos_qc and the values
+computed across two profiles are then discarded, so that the resulting flags
+are identical to running ioos_qc on each profile individually.
+"""
+
+import warnings
+from inspect import signature
+
+import numpy as np
+import pandas as pd
+from ioos_qc import qartod
+from ioos_qc.qartod import QartodFlags
+from ioos_qc.utils import mapdates
+from loguru import logger
+
+# numpy<2 ptp ranges over the valid values of masked arrays whereas numpy>=2
+# ptp ignores the mask and propagates the nan values
+PTP_IGNORES_MASK = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+
+def _masked_invalid(values):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return np.ma.masked_invalid(np.array(values).astype(np.float64))
+
+
+def _segments_mean(values, starts, counts):
+    """Mean of each segment ignoring nan values"""
+    sums = np.add.reduceat(np.nan_to_num(values, nan=0), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def gross_range_test(inp, starts, fail_span, suspect_span=None):
+    """ioos_qc gross_range_test applied to segmented arrays"""
+    # Each record is tested independently of its neighbours
+    return np.asarray(
+        qartod.gross_range_test(inp, fail_span=fail_span, suspect_span=suspect_span)
+    )
+
+
+def rate_of_change_test(inp, tinp, starts, threshold):
+    """ioos_qc rate_of_change_test applied to segmented arrays"""
+    inp = _masked_invalid(inp)
+    flag_arr = np.ma.ones(inp.size, dtype="uint8")
+
+    roc = np.ma.zeros(inp.size, dtype="float")
+    tinp = mapdates(tinp).flatten()
+    roc[1:] = np.abs(
+        np.diff(inp) / np.diff(tinp).astype("timedelta64[s]").astype(float)
+    )
+    # The first record of each segment has no previous record
+    roc[starts] = 0
+
+    with np.errstate(invalid="ignore"):
+        flag_arr[roc > threshold] = QartodFlags.SUSPECT
+    flag_arr[inp.mask] = QartodFlags.MISSING
+    return np.asarray(flag_arr)
+
+
+def attenuated_signal_test(
+    inp,
+    tinp,
+    starts,
+    suspect_threshold,
+    fail_threshold,
+    test_period=None,
+    min_obs=None,
+    min_period=None,
+    check_type="std",
+):
+    """ioos_qc attenuated_signal_test applied to segmented arrays"""
+    bounds = np.append(starts, len(inp))
+    if test_period:
+        # Rolling windows are computed for each segment with ioos_qc
+        return np.concatenate(
+            [
+                qartod.attenuated_signal_test(
+                    inp.iloc[start:end],
+                    tinp.iloc[start:end],
+                    suspect_threshold,
+                    fail_threshold,
+                    test_period=test_period,
+                    min_obs=min_obs,
+                    min_period=min_period,
+                    check_type=check_type,
+                )
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+        )
+
+    inp = _masked_invalid(inp)
+    lengths = np.diff(bounds)
+    if check_type == "std":
+        # Standard deviation of the valid values of each segment
+        values = inp.filled(np.nan)
+        counts = np.add.reduceat(~np.isnan(values), starts)
+        mean = _segments_mean(values, starts, counts)
+        anomaly = values - np.repeat(mean, lengths)
+        check_val = np.sqrt(_segments_mean(anomaly * anomaly, starts, counts))
+    elif check_type == "range":
+        # Same range as the numpy ptp applied by ioos_qc to the masked array
+        if PTP_IGNORES_MASK:
+            values, maximum, minimum = inp.data, np.maximum, np.minimum
+        else:
+            values, maximum, minimum = inp.filled(np.nan), np.fmax, np.fmin
+        with np.errstate(invalid="ignore"):
+            check_val = maximum.reduceat(values, starts) - minimum.reduceat(
+                values, starts
+            )
+    else:
+        raise ValueError(
+            'Check type "{}" is not one of ["std", "range"]'.format(check_type)
+        )
+    check_val = np.repeat(check_val, lengths)
+
+    flag_arr = np.full((inp.size,), QartodFlags.UNKNOWN)
+    with np.errstate(invalid="ignore"):
+        flag_arr[check_val >= suspect_threshold] = QartodFlags.GOOD
+        flag_arr[check_val < suspect_threshold] = QartodFlags.SUSPECT
+        flag_arr[np.isnan(check_val)] = QartodFlags.UNKNOWN
+        flag_arr[check_val < fail_threshold] = QartodFlags.FAIL
+    flag_arr[inp.mask] = QartodFlags.MISSING
+    return flag_arr
+
+
+def density_inversion_test(
+    inp, zinp, starts, suspect_threshold=None, fail_threshold=None
+):
+    """ioos_qc density_inversion_test applied to segmented arrays"""
+    inp = _masked_invalid(inp)
+    zinp = _masked_invalid(zinp)
+    flag_arr = QartodFlags.GOOD * np.ma.ones(inp.size, dtype="uint8")
+
+    # Ignore the pairs of records overlapping two segments
+    within_segment = np.ones(max(inp.size - 1, 0), dtype=bool)
+    within_segment[starts[1:] - 1] = False
+
+    delta = np.sign(np.diff(zinp)) * np.diff(inp)
+    for threshold, flag in (
+        (suspect_threshold, QartodFlags.SUSPECT),
+        (fail_threshold, QartodFlags.FAIL),
+    ):
+        if threshold is None:
+            continue
+        # Masked deltas are never flagged
+        with np.errstate(invalid="ignore"):
+            is_flagged = (delta < threshold) == True  # noqa: E712
+        is_flagged = np.asarray(is_flagged) & within_segment
+        flag_arr[:-1][is_flagged] = flag
+        flag_arr[1:][is_flagged] = flag
+
+    is_missing = inp.mask | zinp.mask
+    flag_arr[is_missing] = QartodFlags.MISSING
+    flag_arr[1:][is_missing[:-1] & within_segment] = QartodFlags.MISSING
+
+    # Single record segments are flagged as UNKNOWN
+    is_single = np.diff(np.append(starts, inp.size)) == 1
+    flag_arr[starts[is_single]] = QartodFlags.UNKNOWN
+    return np.asarray(flag_arr)
+
+
+BATCH_TESTS = {
+    "gross_range_test": gross_range_test,
+    "rate_of_change_test": rate_of_change_test,
+    "attenuated_signal_test": attenuated_signal_test,
+    "density_inversion_test": density_inversion_test,
+}
+
+
+def is_supported(qc_config: dict) -> bool:
+    """Check if all the tests of an ioos_qc configuration can be run in batch."""
+    columns = set()
+    for context in qc_config["contexts"]:
+        if set(context) - {"streams"}:
+            return False
+        for stream, modules in context["streams"].items():
+            if set(modules) - {"qartod"}:
+                return False
+            for test in modules["qartod"]:
+                if test not in BATCH_TESTS or (stream, test) in columns:
+                    return False
+                columns.add((stream, test))
+    return True
+
+
+def run_qartod_tests(
+    df: pd.DataFrame,
+    qc_config: dict,
+    by: list,
+    tinp="t",
+    zinp="z",
+    lat="lat",
+    lon="lon",
+) -> pd.DataFrame:
+    """Run the QARTOD tests of an ioos_qc configuration on each group of
+    records of a dataframe.
+
+    Equivalent to running ioos_qc PandasStream on each group of
+    `df.groupby(by)`: the records are returned in the groups order with one
+    additional column per test named `{stream}_qartod_{test}`.
+
+    Args:
+        df (pd.DataFrame): records to test
+        qc_config (dict): ioos_qc configuration
+        by (list): columns defining each group
+        tinp, zinp, lat, lon (str): time, depth, latitude and longitude columns
+
+    Returns:
+        pd.DataFrame: tested records
+    """
+    if df.empty:
+        return df
+
+    # Sort records by group while retaining their order within each group
+    df = df.dropna(subset=by)
+    groups = df.groupby(by, sort=True).ngroup().values
+    order = np.argsort(groups, kind="stable")
+    df = df.iloc[order]
+    starts = np.flatnonzero(np.diff(groups[order], prepend=-1))
+
+    axes = {"tinp": df[tinp], "zinp": df[zinp]}
+    results = {}
+    for context in qc_config["contexts"]:
+        for stream, modules in context["streams"].items():
+            if stream not in df:
+                logger.warning("{} is not a column in the dataframe, skipping", stream)
+                continue
+            for test, kwargs in modules["qartod"].items():
+                func = BATCH_TESTS[test]
+                parameters = signature(func).parameters
+                kwargs = {
+                    key: value
+                    for key, value in {**kwargs, **axes}.items()
+                    if key in parameters
+                }
+                results[f"{stream}_qartod_{test}"] = func(
+                    inp=df[stream], starts=starts, **kwargs
+                )
+    return pd.concat([df, pd.DataFrame(results, index=df.index)], axis=1)
+
+
+def unrecorded_streams(df: pd.DataFrame, qc_config: dict, by: list) -> dict:
+    """Find the streams without any value within each group of records.
+
+    Only the streams whose tests can all be run in batch are considered, so
+    that their flags can be generated afterwards with fill_unrecorded_streams.
+
+    Returns:
+        dict: {group: frozenset of streams without any value}
+    """
+    streams = [
+        stream
+        for context in qc_config["contexts"]
+        for stream, modules in context["streams"].items()
+        if stream in df and set(modules["qartod"]) <= set(BATCH_TESTS)
+    ]
+    recorded = df[streams].notna().groupby([df[column] for column in by]).any()
+    columns = np.array(recorded.columns)
+    return {
+        key: frozenset(columns[~is_recorded])
+        for key, is_recorded in zip(recorded.index, recorded.values)
+    }
+
+
+def fill_unrecorded_streams(
+    df: pd.DataFrame,
+    qc_config: dict,
+    by: list,
+    unrecorded: dict,
+    tinp="t",
+    zinp="z",
+    lat="lat",
+    lon="lon",
+) -> pd.DataFrame:
+    """Generate the flags of the streams skipped within each group of records
+    because they had no value, so that the tested records have the same
+    columns as if all the streams were tested.
+
+    Args:
+        df (pd.DataFrame): records tested without the unrecorded streams
+        qc_config (dict): ioos_qc configuration
+        by (list): columns defining each group
+        unrecorded (dict): {group: streams skipped} from unrecorded_streams
+        tinp, zinp, lat, lon (str): time, depth, latitude and longitude columns
+
+    Returns:
+        pd.DataFrame: tested records
+    """
+    streams = frozenset().union(*unrecorded.values())
+    if not streams:
+        return df
+
+    skipped_groups = [key for key, skipped in unrecorded.items() if skipped]
+    is_skipped = pd.MultiIndex.from_frame(df[by]).isin(skipped_groups)
+    streams_config = {
+        "contexts": [
+            {
+                "streams": {
+                    stream: modules
+                    for stream, modules in context["streams"].items()
+                    if stream in streams
+                }
+            }
+            for context in qc_config["contexts"]
+        ]
+    }
+    df_skipped = run_qartod_tests(
+        df.loc[is_skipped, list(dict.fromkeys([*by, tinp, zinp, *streams]))],
+        streams_config,
+        by,
+        tinp=tinp,
+        zinp=zinp,
+        lat=lat,
+        lon=lon,
+    )
+
+    df = df.copy()
+    for context in streams_config["contexts"]:
+        for stream, modules in context["streams"].items():
+            for test in modules["qartod"]:
+                column = f"{stream}_qartod_{test}"
+                flags = df_skipped[column]
+                if column in df:
+                    df[column] = df[column].fillna(flags).astype(flags.dtype)
+                else:
+                    df[column] = flags
+
+    # Retain the columns order of ioos_qc results
+    flag_columns = [
+        f"{stream}_qartod_{test}"
+        for context in qc_config["contexts"]
+        for stream, modules in context["streams"].items()
+        if stream in df
+        for test in modules["qartod"]
+    ]
+    return df[
+        [column for column in df.columns if column not in flag_columns]
+        + [column for column in flag_columns if column in df]
+    ]
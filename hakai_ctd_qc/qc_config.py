@@ -0,0 +1,163 @@
+"""QC Configuration
+Compile the QARTOD and Hakai tests configurations into immutable objects
+built once and shared by every chunk qced within a process: the ioos_qc
+configurations of the profiles and static measurements, the list of tested
+variables and the flag columns aggregated for each of them.
+"""
+
+import copy
+import json
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple
+
+from ioos_qc import qartod
+from ioos_qc.config import Config
+
+from hakai_ctd_qc.predicates import compile_predicate
+
+# QARTOD tests which aren't compatible with static unique measurements
+STATIC_EXCLUDED_TESTS = ("attenuated_signal_test",)
+
+
+def freeze(value):
+    """Recursively convert dictionaries and lists to read-only mappings
+    and tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Convert a frozen configuration back to dictionaries and lists."""
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class QartodConfig(NamedTuple):
+    """QARTOD configuration with its ioos_qc counterpart.
+
+    Attributes:
+        tests (MappingProxyType): read-only ioos_qc configuration
+        ioos_config (Config): ioos_qc configuration object
+    """
+
+    tests: MappingProxyType
+    ioos_config: Config
+
+    @classmethod
+    def compile(cls, qartod_config: dict):
+        return cls(freeze(qartod_config), Config(copy.deepcopy(qartod_config)))
+
+    def drop_streams(self, streams) -> "QartodConfig":
+        """Configuration without the tests of the given streams, compiled
+        once per process for each configuration and set of streams"""
+        streams = frozenset(streams)
+        if not streams:
+            return self
+        return _drop_streams(json.dumps(thaw(self.tests)), streams)
+
+
+@lru_cache(maxsize=None)
+def _drop_streams(qartod_config: str, streams: frozenset) -> QartodConfig:
+    qartod_config = json.loads(qartod_config)
+    for context in qartod_config["contexts"]:
+        context["streams"] = {
+            stream: modules
+            for stream, modules in context["streams"].items()
+            if stream not in streams
+        }
+    return QartodConfig.compile(qartod_config)
+
+
+class CompiledQCConfig(NamedTuple):
+    """QC configurations compiled by compile_qc_config.
+
+    Attributes:
+        profile (QartodConfig): QARTOD tests applied to the profiles
+        static (QartodConfig): QARTOD tests applied to static measurements
+        hakai_tests (MappingProxyType): read-only hakai tests configuration
+        tested_variables (tuple): variables tested by QARTOD
+        flag_columns (MappingProxyType): {variable: compiled regex of the
+            flag columns aggregated into the variable flags}
+    """
+
+    profile: QartodConfig
+    static: QartodConfig
+    hakai_tests: MappingProxyType
+    tested_variables: tuple
+    flag_columns: MappingProxyType
+
+
+def _validate(qartod_config: dict, hakai_tests_config: dict):
+    contexts = qartod_config.get("contexts")
+    if not isinstance(contexts, list) or not contexts:
+        raise ValueError("QARTOD configuration requires a list of contexts")
+    for context in contexts:
+        for stream, modules in context.get("streams", {}).items():
+            if not isinstance(modules.get("qartod"), dict):
+                raise ValueError(f"No QARTOD tests configured for {stream}")
+            for test in modules["qartod"]:
+                if not callable(getattr(qartod, test, None)):
+                    raise ValueError(f"Unknown QARTOD test {test} for {stream}")
+    if "default" not in hakai_tests_config.get("flag_aggregation", {}):
+        raise ValueError("Hakai tests configuration requires flag_aggregation.default")
+    for query in hakai_tests_config.get("query_based_flag", []):
+        if {"query", "flag_columns", "flag_value"} - set(query):
+            raise ValueError(f"Incomplete query_based_flag {query}")
+        # Compile each query once, invalid expressions raise a ValueError
+        compile_predicate(query["query"])
+
+
+def compile_qc_config(qartod_config: dict, hakai_tests_config: dict):
+    """Validate and compile the QARTOD and hakai tests configurations.
+
+    The given configurations are copied and never modified.
+
+    Args:
+        qartod_config (dict): ioos_qc configuration
+        hakai_tests_config (dict): hakai tests configuration
+
+    Returns:
+        CompiledQCConfig: compiled configurations
+    """
+    _validate(qartod_config, hakai_tests_config)
+
+    static_qartod_config = copy.deepcopy(qartod_config)
+    for context in static_qartod_config["contexts"]:
+        for tests in context["streams"].values():
+            for test in STATIC_EXCLUDED_TESTS:
+                tests["qartod"].pop(test, None)
+
+    tested_variables = tuple(
+        dict.fromkeys(
+            stream
+            for context in qartod_config["contexts"]
+            for stream in context["streams"]
+        )
+    )
+    flag_aggregation = hakai_tests_config["flag_aggregation"]
+    flag_columns = {
+        var: re.compile(
+            "|".join(
+                flag_aggregation["default"]
+                + flag_aggregation.get(var, [])
+                + [f"{var}_qartod_.*|{var}_hakai_.*|{var}_manual_qc_flag"]
+            )
+        )
+        for var in tested_variables
+    }
+
+    return CompiledQCConfig(
+        profile=QartodConfig.compile(qartod_config),
+        static=QartodConfig.compile(static_qartod_config),
+        hakai_tests=freeze(hakai_tests_config),
+        tested_variables=tested_variables,
+        flag_columns=MappingProxyType(flag_columns),
+    )
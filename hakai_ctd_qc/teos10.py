@@ -0,0 +1,104 @@
+"""TEOS-10
+Derived ocean variables computed with the TEOS-10 gsw functions. The records
+are split into blocks computed concurrently within a thread pool, gsw
+functions being numpy ufuncs which release the GIL, and the results of each
+block are copied into preallocated arrays.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import gsw
+import numpy as np
+import pandas as pd
+
+from hakai_ctd_qc.hakai_tests import is_bad_value
+
+BLOCK_SIZE = 50_000
+DEFAULT_THREADS = min(os.cpu_count() or 1, 4)
+DERIVED_VARIABLES = (
+    "absolute salinity",
+    "conservative temperature",
+    "density",
+    "sigma0",
+)
+
+
+def _drop_sbe_flag(values):
+    return np.where(is_bad_value(values), np.nan, values)
+
+
+def _compute_block(inputs: dict, outputs: dict, block: slice):
+    salinity, pressure, temperature = (
+        inputs[name][block] for name in ("salinity", "pressure", "temperature")
+    )
+    longitude, latitude = (
+        np.where(np.isnan(station), measured, station)
+        for station, measured in (
+            (inputs["station_longitude"][block], inputs["longitude"][block]),
+            (inputs["station_latitude"][block], inputs["latitude"][block]),
+        )
+    )
+    absolute_salinity, conservative_temperature, density, sigma0 = (
+        outputs[name][block] for name in DERIVED_VARIABLES
+    )
+    # The results are copied into the block of the preallocated arrays rather
+    # than written with `out=`, which older gsw releases don't support
+    clean_pressure = _drop_sbe_flag(pressure)
+    absolute_salinity[:] = gsw.SA_from_SP(
+        _drop_sbe_flag(salinity), clean_pressure, longitude, latitude
+    )
+    # Conservative temperature is computed with the original pressure
+    conservative_temperature[:] = gsw.CT_from_t(
+        absolute_salinity, _drop_sbe_flag(temperature), pressure
+    )
+    density[:] = gsw.rho(absolute_salinity, conservative_temperature, clean_pressure)
+    sigma0[:] = gsw.sigma0(absolute_salinity, conservative_temperature)
+
+
+def derived_ocean_variables(
+    df: pd.DataFrame, threads: int = None, block_size: int = BLOCK_SIZE
+) -> dict:
+    """Compute the absolute salinity, conservative temperature, density and
+    sigma0 of each record.
+
+    The Seabird bad values of the salinity, temperature and pressure are
+    ignored and the station coordinates are used when available.
+
+    Args:
+        df (pd.DataFrame): records with salinity, temperature, pressure and
+            station and measured coordinates
+        threads (int): number of threads computing the blocks concurrently
+            (default to DEFAULT_THREADS)
+        block_size (int): number of records computed at once by each thread
+
+    Returns:
+        dict: {variable: np.ndarray} of each derived variable
+    """
+    inputs = {
+        name: df[name].to_numpy(dtype=float)
+        for name in (
+            "salinity",
+            "pressure",
+            "temperature",
+            "station_longitude",
+            "longitude",
+            "station_latitude",
+            "latitude",
+        )
+    }
+    outputs = {name: np.empty(len(df)) for name in DERIVED_VARIABLES}
+    blocks = [
+        slice(start, start + block_size) for start in range(0, len(df), block_size)
+    ]
+
+    threads = min(threads or DEFAULT_THREADS, len(blocks))
+    if threads <= 1:
+        for block in blocks:
+            _compute_block(inputs, outputs, block)
+        return outputs
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # Consume the results to raise the errors of any block
+        list(executor.map(lambda block: _compute_block(inputs, outputs, block), blocks))
+    return outputs
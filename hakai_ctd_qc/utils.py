@@ -1,6 +1,9 @@
+import asyncio
 import time
 from functools import wraps
 
+from loguru import logger
+
 
 def retry(attempts=3, delay=1, exceptions=Exception):
     def decorator(func):
@@ -19,3 +22,28 @@ def retry(attempts=3, delay=1, exceptions=Exception):
         return wrapper
 
     return decorator
+
+
+def async_retry(attempts=3, delay=1, exceptions=Exception):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions as e:
+                    logger.warning(
+                        "Attempt {}/{} of {} failed with error: {}",
+                        attempt,
+                        attempts,
+                        func.__name__,
+                        e,
+                    )
+                    await asyncio.sleep(delay)
+            raise Exception(
+                f"Failed to execute {func.__name__} after {attempts} attempts"
+            )
+
+        return wrapper
+
+    return decorator
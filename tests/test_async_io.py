@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hakai_ctd_qc import async_io
+
+
+class SlowSession:
+    def __init__(self, delay=0.2):
+        self.delay = delay
+
+    def get(self, url, **kwargs):
+        time.sleep(self.delay)
+        return url
+
+
+class TestAsyncIO:
+    def test_requests_run_concurrently(self):
+        session = SlowSession()
+        urls = [f"https://example.com/{i}" for i in range(5)]
+        start = time.perf_counter()
+        results = async_io.run(
+            async_io.gather(*[async_io.request(session, "get", url) for url in urls])
+        )
+        elapsed = time.perf_counter() - start
+        sequential = session.delay * len(urls)
+        assert results == urls, "Results aren't returned in the requested order"
+        assert elapsed < sequential, "Requests were not sent concurrently"
+
+    def test_connection_pool_keeps_retries(self):
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(max_retries=Retry(total=4)))
+        async_io.mount_connection_pool(session, pool_size=25)
+        adapter = session.get_adapter("https://hecate.hakai.org/api")
+        assert adapter._pool_maxsize == 25
+        assert adapter.max_retries.total == 4
+        assert session.get_adapter("http://hecate.hakai.org/api")._pool_maxsize == 25
+
+    def test_run_within_running_event_loop(self):
+        async def _nested():
+            return async_io.run(async_io.request(SlowSession(0), "get", "url"))
+
+        assert asyncio.run(_nested()) == "url"
@@ -0,0 +1,128 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+import hakai_ctd_qc.__main__
+from hakai_ctd_qc.__main__ import (
+    _casts_fingerprint,
+    _derived_ocean_variables,
+    run_qc_profiles,
+)
+from hakai_ctd_qc.cache import ResponseCache, ResultCache
+from hakai_ctd_qc.context import QCContext
+
+
+@pytest.fixture(scope="module")
+def df_casts(df_initial):
+    hakai_ids = df_initial["hakai_id"].drop_duplicates().iloc[:3]
+    return _derived_ocean_variables(
+        df_initial.loc[df_initial["hakai_id"].isin(hakai_ids)].reset_index()
+    )
+
+
+@pytest.fixture(scope="module")
+def context(df_casts):
+    """Context with a stub station list and without hakai api cache"""
+    context = QCContext(api_cache=False)
+    context.stations = pd.DataFrame(
+        {
+            "station": df_casts["station"].dropna().unique(),
+            "station_depth": 100.0,
+        }
+    )
+    return context
+
+
+def _sorted(df):
+    return df.sort_values("ctd_data_pk").reset_index(drop=True)
+
+
+class TestResultCache:
+    def test_put_get(self, tmp_path):
+        cache = ResultCache(tmp_path)
+        df = pd.DataFrame({"a": [1, 2], "b": ["x", None]})
+        assert cache.get("abcd") is None
+        cache.put("abcd", df)
+        pd.testing.assert_frame_equal(cache.get("abcd"), df)
+
+    def test_fingerprint_changes_with_data(self, df_casts, df_local_metadata, context):
+        fingerprints = _casts_fingerprint(df_casts, df_local_metadata, context)
+        assert len(fingerprints) == 3
+        assert fingerprints == _casts_fingerprint(df_casts, df_local_metadata, context)
+
+        df_modified = df_casts.copy()
+        hakai_id = df_modified["hakai_id"].iloc[0]
+        df_modified.loc[0, "temperature"] += 1
+        modified = _casts_fingerprint(df_modified, df_local_metadata, context)
+        assert modified[hakai_id] != fingerprints[hakai_id]
+        assert {k: v for k, v in modified.items() if k != hakai_id} == {
+            k: v for k, v in fingerprints.items() if k != hakai_id
+        }
+
+    def test_fingerprint_changes_with_engine_and_version(
+        self, df_casts, df_local_metadata, context, monkeypatch
+    ):
+        fingerprints = _casts_fingerprint(df_casts, df_local_metadata, context)
+        batch_context = QCContext(qartod_engine="batch")
+        batch_context.stations = context.stations
+        batch = _casts_fingerprint(df_casts, df_local_metadata, batch_context)
+        assert set(batch.values()).isdisjoint(fingerprints.values())
+
+        monkeypatch.setattr(hakai_ctd_qc.__main__, "__version__", "0.0.0")
+        version = _casts_fingerprint(df_casts, df_local_metadata, context)
+        assert set(version.values()).isdisjoint(fingerprints.values())
+
+    def test_cached_results_match(self, df_casts, df_local_metadata, context, tmp_path):
+        cache = ResultCache(tmp_path)
+        df_qced = run_qc_profiles(
+            df_casts, df_local_metadata, cache=cache, context=context
+        )
+        cached_files = sorted(tmp_path.glob("*/*.pkl"))
+        assert len(cached_files) == 3
+
+        df_cached = run_qc_profiles(
+            df_casts, df_local_metadata, cache=cache, context=context
+        )
+        assert sorted(tmp_path.glob("*/*.pkl")) == cached_files
+        pd.testing.assert_frame_equal(
+            _sorted(df_cached)[df_qced.columns], _sorted(df_qced)
+        )
+
+
+class TestResponseCache:
+    url = "https://hecate.hakai.org/api/eims/views/output/sites?limit=-1"
+    df = pd.DataFrame({"name": ["QU39", "QU24"], "depth": [270, None]})
+
+    def test_put_get(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+        assert cache.get(self.url) is None
+        cache.put(self.url, self.df)
+        pd.testing.assert_frame_equal(cache.get(self.url), self.df)
+
+    def test_endpoint_ttl(self, tmp_path):
+        cache = ResponseCache(tmp_path, ttls={"/eims/views/output/sites": 60})
+        cache.put(self.url, self.df)
+        path = cache._path(self.url)
+        os.utime(path, (time.time(), time.time() - 120))
+        assert cache.get(self.url) is None, "Expired response shouldn't be used"
+
+        other_url = "https://hecate.hakai.org/api/ctd/views/file/cast?limit=-1"
+        cache.put(other_url, self.df)
+        assert cache.get(other_url) is None, "Endpoint without ttl shouldn't be cached"
+
+    def test_lru_eviction(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+        urls = [f"{self.url}&station={i}" for i in range(3)]
+        for i, url in enumerate(urls):
+            cache.put(url, self.df)
+            now = time.time()
+            os.utime(cache._path(url), (now - 100 + i, now))
+        cache.get(urls[0])
+
+        cache.max_size = sum(path.stat().st_size for path in tmp_path.iterdir()) - 1
+        cache.evict()
+        assert cache.get(urls[1]) is None, "Least recently used should be evicted"
+        assert cache.get(urls[0]) is not None
+        assert cache.get(urls[2]) is not None
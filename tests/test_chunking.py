@@ -0,0 +1,52 @@
+import pandas as pd
+
+from hakai_ctd_qc.chunking import AdaptiveChunker
+
+casts = pd.DataFrame(
+    {
+        "hakai_id": [f"{i:06d}_2020-01-01T00:00:00Z" for i in range(100)],
+        "cast_type": ["Dynamic", "Static"] * 50,
+    }
+)
+
+
+class TestAdaptiveChunker:
+    def test_all_casts_are_chunked_once(self):
+        chunks = list(AdaptiveChunker(casts, initial_chunksize=7))
+        assert pd.concat(chunks)["hakai_id"].tolist() == casts["hakai_id"].tolist()
+        assert len(chunks[0]) == 7, "First chunk should use the initial chunksize"
+
+    def test_url_length_limit(self):
+        max_url_length = 500
+        chunker = AdaptiveChunker(
+            casts,
+            initial_chunksize=100,
+            max_url_length=max_url_length,
+            url_overhead=100,
+        )
+        for chunk in chunker:
+            assert len(",".join(chunk["hakai_id"])) <= max_url_length - 100
+
+    def test_chunks_sized_by_memory_budget(self):
+        chunker = AdaptiveChunker(
+            casts, initial_chunksize=10, memory_budget=1000 * 100, target_duration=None
+        )
+        chunks = iter(chunker)
+        first_chunk = next(chunks)
+        # Dynamic casts have 190 records and static casts 10 records of 100 bytes
+        records = {
+            hakai_id: 190 if cast_type == "Dynamic" else 10
+            for hakai_id, cast_type in first_chunk[["hakai_id", "cast_type"]].values
+        }
+        chunker.record(records, nbytes=sum(records.values()) * 100)
+        assert chunker.records_per_cast == {"Dynamic": 190, "Static": 10}
+        assert len(next(chunks)) == 10, "Next chunk should hold ~1000 records"
+
+    def test_chunks_sized_by_duration(self):
+        chunker = AdaptiveChunker(
+            casts, initial_chunksize=10, memory_budget=None, target_duration=1
+        )
+        chunks = iter(chunker)
+        first_chunk = next(chunks)
+        chunker.record(dict.fromkeys(first_chunk["hakai_id"], 10), duration=10)
+        assert len(next(chunks)) == 1, "Chunk should be reduced to a single cast"
@@ -0,0 +1,78 @@
+import pickle
+
+import pandas as pd
+import requests
+
+from hakai_ctd_qc import async_io
+from hakai_ctd_qc import context as context_module
+from hakai_ctd_qc.cache import ResponseCache
+from hakai_ctd_qc.context import STATION_LIST_URL, QCContext
+
+
+class StubClient:
+    def __init__(self, stations):
+        self.stations = stations
+
+    def get(self, url):
+        assert url == STATION_LIST_URL
+        return StubResponse(self.stations)
+
+
+class StubResponse:
+    def __init__(self, records):
+        self.records = records
+
+    def json(self):
+        return self.records
+
+
+class TestQCContext:
+    def test_resources_are_initialized_lazily(self):
+        context = QCContext()
+        assert "client" not in context.__dict__
+        assert "stations" not in context.__dict__
+        assert "contexts" in context.qartod_config
+        assert "qartod_config" in context.__dict__
+        assert context.qartod_config is context.qartod_config
+
+    def test_shared_resources_are_pickled(self):
+        context = QCContext(api_cache_size=10)
+        context.client = StubClient([{"name": "QU39", "depth": 280.0}])
+        context.preload()
+        context.qc_config
+        unpickled = pickle.loads(pickle.dumps(context))
+        assert unpickled.api_cache_size == 10
+        for resource in ("client", "response_cache", "qc_config"):
+            assert resource not in unpickled.__dict__
+        pd.testing.assert_frame_equal(unpickled.stations, context.stations)
+        pd.testing.assert_frame_equal(unpickled.grey_list, context.grey_list)
+        assert unpickled.qartod_config == context.qartod_config
+        assert unpickled.qc_config.tested_variables == (
+            context.qc_config.tested_variables
+        )
+
+    def test_configure_api_cache(self, tmp_path):
+        context = QCContext(api_cache_dir=tmp_path, api_cache=True)
+        assert context.response_cache.directory == tmp_path
+        context.configure_api_cache(tmp_path, enabled=False)
+        assert context.response_cache is None
+        context.configure_api_cache(tmp_path, enabled=True)
+        assert context.response_cache.directory == tmp_path
+
+    def test_configure_connection_pool(self):
+        context = QCContext()
+        context.client = async_io.mount_connection_pool(requests.Session())
+        context.configure_connection_pool(30)
+        assert context.pool_size == 30
+        assert context.client.get_adapter("https://")._pool_maxsize == 30
+
+    def test_api_cache_is_disabled_by_default(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(context_module, "DEFAULT_RESPONSE_CACHE_DIR", tmp_path)
+        ResponseCache(tmp_path).put(
+            STATION_LIST_URL, pd.DataFrame({"name": ["QU39"], "depth": [100.0]})
+        )
+
+        context = QCContext()
+        context.client = StubClient([{"name": "QU39", "depth": 280.0}])
+        assert context.response_cache is None
+        assert context.stations["station_depth"].tolist() == [280.0]
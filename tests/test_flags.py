@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hakai_ctd_qc.flags import FlagMatrix
+
+selectors = {"x": "x_qartod_.*|bottom_hit_test", "y": "y_qartod_.*|bottom_hit_test"}
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "x": [1.0, 2, 3, None],
+            "y": [1.0, 2, 3, 4],
+            "x_qartod_gross_range_test": np.array([1, 3, 9, 4], dtype="uint8"),
+            "x_qartod_rate_of_change_test": [2.0, 4, None, 1],
+            "y_qartod_gross_range_test": [9, 9, 2, 9],
+            "bottom_hit_test": [1, 1, 1, 3],
+        }
+    )
+
+
+class TestFlagMatrix:
+    def test_registry(self, df):
+        flag_matrix = FlagMatrix(df, selectors)
+        assert flag_matrix.values.dtype == np.uint8
+        assert flag_matrix.registry["bottom_hit_test"] == ("x", "y")
+        assert flag_matrix.registry["x_qartod_gross_range_test"] == ("x",)
+        assert "x" not in flag_matrix.tests
+
+    def test_level_1(self, df):
+        flag_matrix = FlagMatrix(df, selectors)
+        rows, flags = flag_matrix.level_1("x", df["x"].notna().to_numpy())
+        assert rows.tolist() == [0, 1, 2]
+        assert flags.tolist() == [1, 4, 1]
+        rows, flags = flag_matrix.level_1("y")
+        assert rows.tolist() == [0, 1, 2, 3]
+        assert flags.tolist() == [1, 1, 1, 3]
+
+    def test_level_2(self, df):
+        flag_matrix = FlagMatrix(df, selectors)
+        assert flag_matrix.level_2("x", np.array([0, 1, 3])).tolist() == [
+            pd.NA,
+            "SVD: x_qartod_rate_of_change_test; SVC: x_qartod_gross_range_test",
+            "SVD: x_qartod_gross_range_test; SVC: bottom_hit_test",
+        ]
+
+    def test_level_2_repeated_combinations(self, df):
+        flag_matrix = FlagMatrix(df, selectors)
+        descriptions = flag_matrix.level_2("x", np.array([0, 1, 3, 1, 0]))
+        assert pd.isna(descriptions).tolist() == [True, False, False, False, True]
+        assert descriptions[1] is descriptions[3], "Description isn't shared"
+
+    def test_unexpected_flag_values(self, df):
+        df.loc[0, "bottom_hit_test"] = 5
+        with pytest.raises(ValueError):
+            FlagMatrix(df, selectors)
+
+    def test_aggregated_flags_are_not_tests(self, df):
+        df["x_flag_level_1"] = 1
+        with pytest.raises(RuntimeError):
+            FlagMatrix(df, {"x": "x_"})
@@ -1,7 +1,10 @@
+import json
+
+import numpy as np
 import pandas as pd
 import pytest
 
-from hakai_ctd_qc.__main__ import _get_hakai_flag_columns
+from hakai_ctd_qc.__main__ import _generate_process_flags_json, _get_hakai_flag_columns
 
 
 @pytest.fixture(scope="function")
@@ -111,3 +114,48 @@ class TestHakaiFlags:
         assert pd.isna(df.loc[0, "x_flag_level_1"]), "Flag level 1 should be null"
         assert (df.loc[df.index[1:], "x_flag"].str.startswith("AV")).all()
         assert (df.loc[df.index[1:], "x_flag_level_1"] == 1).all()
+
+
+class TestProcessFlagsJson:
+    casts = pd.DataFrame(
+        {
+            "ctd_cast_pk": [1, 2],
+            "hakai_id": ["a", "b"],
+            "processing_stage": ["9_qc_auto", "9_qc_auto"],
+            "process_error": ["", ""],
+        }
+    )
+    data = pd.DataFrame(
+        {
+            "ctd_data_pk": [10, 20, 11, 21],
+            "hakai_id": ["a", "b", "a", "b"],
+            "direction_flag": ["d", "d", "d", "d"],
+            "x": [1.0, 2.0, 3.0, 4.0],
+            "x_flag": ["SVC: test", np.nan, None, "AV"],
+            "x_flag_level_1": ["3", "1", "1", "1"],
+        }
+    )
+
+    def test_casts_payloads(self):
+        casts_json = _generate_process_flags_json(self.casts, self.data)
+        assert list(casts_json) == ["a", "b"]
+        cast_a = json.loads(casts_json["a"])
+        assert cast_a["cast"] == {
+            "ctd_cast_pk": 1,
+            "hakai_id": "a",
+            "processing_stage": "9_qc_auto",
+            "process_error": "",
+        }
+        assert cast_a["ctd_data"] == [
+            {"ctd_data_pk": 10, "x_flag": "SVC: test", "x_flag_level_1": "3"},
+            {"ctd_data_pk": 11, "x_flag": None, "x_flag_level_1": "1"},
+        ]
+        assert [
+            record["ctd_data_pk"] for record in json.loads(casts_json["b"])["ctd_data"]
+        ] == [20, 21], "Records order within a cast isn't retained"
+
+    def test_cast_without_data(self):
+        casts_json = _generate_process_flags_json(
+            self.casts, self.data.query("hakai_id == 'a'")
+        )
+        assert json.loads(casts_json["b"])["ctd_data"] == []
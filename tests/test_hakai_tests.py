@@ -1,3 +1,5 @@
+import re
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -43,6 +45,43 @@ class TestHakaiBadValues:
         ), "Other records were not flag as GOOD=1"
 
 
+class TestBadValueScan:
+    def test_tolerant_seabird_bad_value(self):
+        df = pd.DataFrame({"x": [1.0, float(np.float32(-9.99e-29)), -9.98e-29]})
+        df = hakai_tests.bad_value_test(df, ["x"])
+        assert df["x_hakai_bad_value_test"].tolist() == [1, 4, 1]
+
+    def test_drop_bad_values(self):
+        df = pd.DataFrame(
+            {
+                "x": [1.0, -9.99e-29, np.nan],
+                "y": [-9.99e-29, 2.0, 3.0],
+                "station": ["a", None, "b"],
+            }
+        )
+        df = hakai_tests.bad_value_test(df, ["x"], drop_bad_values=True)
+        assert df["x_hakai_bad_value_test"].tolist() == [1, 4, 9]
+        # Bad values of every column are replaced
+        assert df["x"].isna().tolist() == [False, True, True]
+        assert df["y"].isna().tolist() == [True, False, False]
+        assert df["station"].isna().tolist() == [False, True, False]
+
+    def test_object_and_extension_columns(self):
+        bad_value = float(np.float32(-9.99e-29))
+        df = pd.DataFrame(
+            {
+                "x": pd.Series([1.0, bad_value, "-9.99e-29", None], dtype=object),
+                "y": pd.array([bad_value, 2.0, None, 3.0], dtype="Float64"),
+            }
+        )
+        df = hakai_tests.bad_value_test(df, ["x", "y"], drop_bad_values=True)
+        # Numeric values match within the tolerance, strings never match
+        assert df["x_hakai_bad_value_test"].tolist() == [1, 4, 1, 9]
+        assert df["y_hakai_bad_value_test"].tolist() == [4, 1, 9, 1]
+        assert df["x"].isna().tolist() == [False, True, False, True]
+        assert df["y"].isna().tolist() == [True, False, True, False]
+
+
 df_query_test = pd.DataFrame(
     {"x": [1, 2, 3, 4, 5, 6], "y": ["a", "b", "c", "d", "e", "f"]}
 )
@@ -64,9 +103,322 @@ class TestQueryFlag:
             df.loc[df["x"] != 1, "result_test"].isin([1]).all()
         ), "not matching values are not empty"
 
+    def test_missing_query_column(self):
+        with pytest.raises(KeyError):
+            hakai_tests.query_based_flag_test(
+                df_query_test.copy(),
+                [{"query": "z==1", "flag_columns": ["result_test"], "flag_value": 4}],
+            )
+
 
 class TestEmptyInput:
     def test_empty_dataframe_bad_values(self):
         df = pd.DataFrame({"x": []})
         df = hakai_tests.bad_value_test(df, "x")
         assert "x_hakai_bad_value_test" in df, "New flag column was not generated"
+
+
+@pytest.fixture
+def df_grey():
+    return pd.DataFrame(
+        {
+            "measurement_dt": pd.to_datetime(
+                ["2020-01-01", "2020-01-05", "2020-01-10", "2020-01-05"], utc=True
+            ),
+            "device_model": ["XR-620", "XR-620", "XR-620", "RBRconcerto"],
+            "device_sn": ["1", "1", "1", "1"],
+            "hakai_id": ["a", "b", "b", "a"],
+            "par": [1.0, 2.0, 3.0, 4.0],
+            "par_flag_level_1": [1, 1, 1, 1],
+            "par_flag": [pd.NA, "SVC: test", pd.NA, pd.NA],
+        }
+    )
+
+
+def _grey_list_entry(**kwargs):
+    return pd.DataFrame(
+        [
+            {
+                "start_datetime_range": pd.Timestamp("2020-01-01", tz="UTC"),
+                "end_datetime_range": pd.Timestamp("2020-01-05", tz="UTC"),
+                "device_model": "XR-620",
+                "device_sn": "1",
+                "hakai_id": None,
+                "query": None,
+                "data_type": "par",
+                "flag_type": 4,
+                "comments": "Bad cable",
+                "flagged_by": None,
+                **kwargs,
+            }
+        ]
+    )
+
+
+class TestGreyList:
+    def test_grey_list_time_range(self, df_grey):
+        df = hakai_tests.grey_list(df_grey, _grey_list_entry())
+        assert df["par_flag_level_1"].tolist() == [4, 4, 1, 1]
+        assert df["par_grey_list_test"].tolist() == [4, 4, 1, 1]
+        assert df["par_flag"].iloc[0] == "SVD: Hakai Grey List - Bad cable"
+        assert df["par_flag"].iloc[1] == "SVC: test; SVD: Hakai Grey List - Bad cable"
+        assert pd.isna(df["par_flag"].iloc[2])
+
+    def test_grey_list_hakai_id(self, df_grey):
+        df = hakai_tests.grey_list(df_grey, _grey_list_entry(hakai_id="b,c"))
+        assert df["par_flag_level_1"].tolist() == [1, 4, 1, 1]
+
+    def test_grey_list_query(self, df_grey):
+        df = hakai_tests.grey_list(df_grey, _grey_list_entry(query=" and par > 1"))
+        assert df["par_flag_level_1"].tolist() == [1, 4, 1, 1]
+
+    @pytest.mark.parametrize("query", [" and par > 1", "& par > 1", "par > 1"])
+    def test_grey_list_query_filters_entry_records(self, df_grey, query):
+        df_grey["device_sn"] = "1'"
+        df = hakai_tests.grey_list(
+            df_grey,
+            _grey_list_entry(device_sn="1'", hakai_id="a,b", query=query),
+        )
+        assert df["par_flag_level_1"].tolist() == [1, 4, 1, 1]
+
+    def test_grey_list_string_times(self, df_grey):
+        df_grey["measurement_dt"] = df_grey["measurement_dt"].dt.strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z"
+        )
+        # Times are compared as strings with the range bounds
+        # ("2020-01-05 00:00:00+00:00" < "2020-01-05T00:00:00.000Z")
+        df = hakai_tests.grey_list(df_grey, _grey_list_entry())
+        assert df["par_flag_level_1"].tolist() == [4, 1, 1, 1]
+
+
+class TestProcessLogFlags:
+    df = pd.DataFrame({"hakai_id": ["a", "a", "b", "c"]})
+
+    def test_no_soak_warning(self):
+        metadata = pd.DataFrame(
+            {
+                "hakai_id": ["a", "b"],
+                "process_log": [
+                    "WARNING! NO SOAK DETECTED, SUSPICIOUS DATA QUALITY",
+                    None,
+                ],
+                "cast_type": ["Profile", "Profile"],
+            }
+        )
+        df = hakai_tests.apply_flag_from_process_log(self.df.copy(), metadata)
+        for column in hakai_tests.PROCESS_LOG_RULES[1].columns:
+            assert df[column].tolist()[:2] == [3, 3]
+            assert df[column].iloc[2:].isna().all()
+
+    def test_slow_oxygen_sensor_ignore_static_casts(self):
+        metadata = pd.DataFrame(
+            {
+                "hakai_id": ["a", "b"],
+                "process_log": [
+                    "WARNING!!! Slower Oxygen Sensor RBR CODAstandard are not "
+                    "recommended for profiling applications."
+                ]
+                * 2,
+                "cast_type": ["Profile", "Static"],
+            }
+        )
+        df = hakai_tests.apply_flag_from_process_log(self.df.copy(), metadata)
+        assert df["dissolved_oxygen_ml_l_hakai_slow_oxygen_sensor_test"].fillna(
+            0
+        ).tolist() == [3, 3, 0, 0]
+
+    def test_custom_rules(self):
+        metadata = pd.DataFrame(
+            {
+                "hakai_id": ["b", "c"],
+                "process_log": ["Warning: sensor X", "sensor X"],
+                "cast_type": ["Profile", "Profile"],
+            }
+        )
+        rules = [hakai_tests.ProcessLogRule(re.compile("sensor X"), ("x_test",))]
+        df = hakai_tests.apply_flag_from_process_log(self.df.copy(), metadata, rules)
+        assert df["x_test"].fillna(0).tolist() == [0, 0, 3, 0]
+
+
+@pytest.fixture
+def df_profiles():
+    return pd.DataFrame(
+        {
+            "hakai_id": ["b", "a", "a", "b", "a", "a", None],
+            "direction_flag": ["d", "u", "d", "d", "d", "u", "d"],
+            "depth": [2.0, 1, 3, np.nan, 1, 2, 1],
+            "sigma0_qartod_density_inversion_test": [1, 1, 4, 1, 1, 1, 4],
+            "par": [1.0, 3, 8, 2, 20, 6, 5],
+        },
+        index=[10, 11, 12, 13, 14, 15, 16],
+    )
+
+
+class TestProfileIndex:
+    def test_profile_order(self, df_profiles):
+        index = hakai_tests.ProfileIndex(df_profiles)
+        assert index.segments.tolist() == [2, 1, 0, 2, 0, 1, -1]
+        assert index.profile_ids.tolist() == ["a", "b"]
+        assert index.segment_profiles.tolist() == [0, 0, 1]
+        # Missing depths are last in both orders
+        assert index.ascending.tolist() == [4, 2, 1, 5, 0, 3]
+        assert index.descending.tolist() == [2, 4, 5, 1, 0, 3]
+        assert index.offsets.tolist() == [0, 2, 4, 6]
+        assert index.profile(1, descending=True).tolist() == [5, 1]
+
+    def test_reuse_index(self, df_profiles):
+        index = hakai_tests.ProfileIndex(df_profiles)
+        assert hakai_tests.ProfileIndex.of(df_profiles, index) is index
+        assert (
+            hakai_tests.ProfileIndex.of(df_profiles, index, depth_var="par")
+            is not index
+        )
+
+    def test_shared_index(self, df_profiles):
+        index = hakai_tests.ProfileIndex(df_profiles)
+        df = hakai_tests.bottom_hit_detection(
+            df_profiles.copy(),
+            "sigma0_qartod_density_inversion_test",
+            profile_index=index,
+        )
+        assert df["bottom_hit_test"].tolist() == [1, 1, 4, 1, 1, 1, 1]
+        df = hakai_tests.par_shadow_test(df, profile_index=index)
+        assert df["par_shadow_test"].tolist() == [1, 3, 1, 1, 1, 1, 1]
+
+
+class TestParShadow:
+    def test_casts_without_par(self):
+        df = pd.DataFrame(
+            {
+                "hakai_id": ["a"] * 3 + ["b"] * 2,
+                "direction_flag": "d",
+                "depth": [1.0, 2, 3, 1, 2],
+                "par": [10.0, 20, 5, np.nan, np.nan],
+            }
+        )
+        df = hakai_tests.par_shadow_test(df)
+        assert df["par_shadow_test"].tolist() == [3, 1, 1, 2, 2]
+
+    def test_flags_are_independent_of_other_casts(self):
+        df = pd.DataFrame(
+            {
+                "hakai_id": ["a"] * 3 + ["b"] * 2,
+                "direction_flag": "d",
+                "depth": [1.0, 2, 3, 1, 2],
+                "par": [np.nan, np.nan, np.nan, 20, 10],
+            }
+        )
+        flags = hakai_tests.par_shadow_test(df.copy())["par_shadow_test"]
+        for hakai_id, cast in df.groupby("hakai_id"):
+            cast_flags = hakai_tests.par_shadow_test(cast.copy())["par_shadow_test"]
+            assert cast_flags.tolist() == flags[cast.index].tolist()
+
+
+class TestBottomHit:
+    def test_bottom_hit_profiles(self):
+        df = pd.DataFrame(
+            {
+                "hakai_id": ["a"] * 4 + ["b"] * 4,
+                "direction_flag": ["d", "d", "u", "u", "d", "d", "d", "d"],
+                "depth": [1.0, 2, 2, 1, 1, 2, 3, 4],
+                "flag": [1, 4, 3, 1, 1, 3, 1, np.nan],
+            }
+        )
+        df = hakai_tests.bottom_hit_detection(df, "flag")
+        # The up cast of a bottom hit profile is reviewed, missing flags
+        # near the bottom are ignored
+        assert df["bottom_hit_test"].tolist() == [1, 4, 4, 1, 1, 1, 1, 1]
+
+    def test_no_good_record(self):
+        df = pd.DataFrame(
+            {
+                "hakai_id": ["a", "a"],
+                "direction_flag": ["d", "d"],
+                "depth": [1.0, 2],
+                "flag": [3, 4],
+            }
+        )
+        df = hakai_tests.bottom_hit_detection(df, "flag")
+        assert df["bottom_hit_test"].tolist() == [1, 1]
+
+
+def _do_cap_profile(hakai_id, offset, n_bins=10):
+    depth = np.arange(n_bins, dtype=float)
+    return pd.DataFrame(
+        {
+            "hakai_id": hakai_id,
+            "direction_flag": ["d"] * n_bins + ["u"] * n_bins,
+            "depth": np.concatenate([depth, depth[::-1]]),
+            "dissolved_oxygen_ml_l": np.concatenate(
+                [depth / 10 + offset, depth[::-1] / 10]
+            ),
+        }
+    )
+
+
+class TestDOCap:
+    def test_do_cap_flags(self):
+        df = pd.concat(
+            [
+                _do_cap_profile("fail", 1),
+                _do_cap_profile("suspect", 0.3),
+                _do_cap_profile("good", 0.1),
+                _do_cap_profile("unknown", 1, n_bins=3),
+            ],
+            ignore_index=True,
+        )
+        df = hakai_tests.do_cap_test(
+            df, "dissolved_oxygen_ml_l", minimum_bins_per_profile=5
+        )
+        flags = df.groupby("hakai_id")["dissolved_oxygen_ml_l_hakai_do_cap_test"]
+        assert flags.nunique().eq(1).all()
+        assert flags.first().to_dict() == {
+            "fail": 4,
+            "good": 1,
+            "suspect": 3,
+            "unknown": 2,
+        }
+
+    def test_do_cap_downcast_only(self):
+        df = _do_cap_profile("a", 1).query("direction_flag == 'd'").copy()
+        df = hakai_tests.do_cap_test(df, "dissolved_oxygen_ml_l")
+        assert (df["dissolved_oxygen_ml_l_hakai_do_cap_test"] == 2).all()
+
+
+class TestGroupCodes:
+    def test_broadcast(self):
+        df = pd.DataFrame({"hakai_id": ["b", "a", None, "b"]})
+        groups = hakai_tests.GroupCodes.of(df, ["hakai_id"])
+        assert groups.codes.tolist() == [1, 0, -1, 1]
+        assert groups.broadcast([1, 4]).tolist()[:2] == [4.0, 1.0]
+        assert np.isnan(groups.broadcast([1, 4])[2])
+        # Values of a subset of the groups
+        assert groups.broadcast([3], groups=[1], fill_value=0).tolist() == [3, 0, 0, 3]
+
+    def test_broadcast_keeps_dtype(self):
+        df = pd.DataFrame({"hakai_id": ["b", "a", "b"]})
+        flags = hakai_tests.GroupCodes.of(df, ["hakai_id"]).broadcast(np.array([1, 4]))
+        assert flags.dtype == np.dtype(int)
+        assert flags.tolist() == [4, 1, 4]
+
+
+class TestStationDepth:
+    def test_missing_station(self):
+        df = pd.DataFrame(
+            {
+                "hakai_id": ["a", "a", "b", "c"],
+                "station": ["s1", "s1", None, "s2"],
+                "depth": [5.0, 20, 10, 100],
+            }
+        )
+        stations = pd.DataFrame({"station": ["s1", "s2"], "station_depth": [10, 100]})
+        df = hakai_tests.hakai_station_maximum_depth_test(
+            df,
+            stations,
+            suspect_exceedance_percentage=1.1,
+            fail_exceedance_percentage=1.25,
+            suspect_exceedance_range=3,
+            fail_exceedance_range=5,
+        )
+        # Records without station are retained and flagged as UNKNOWN
+        assert df["depth_in_station_range_test"].tolist() == [4, 4, 2, 1]
@@ -0,0 +1,64 @@
+import pandas as pd
+
+from hakai_ctd_qc.__main__ import _journal_chunk
+from hakai_ctd_qc.journal import Journal, hash_items
+
+casts = [(1, "a"), (2, "b"), (3, "c")]
+
+
+class TestJournal:
+    def test_record_stages(self, tmp_path):
+        journal = Journal(tmp_path / "journal.sqlite", "run")
+        journal.record("pending", casts)
+        journal.record("qced", casts[:2])
+        journal.record("uploaded", casts[:1])
+        assert journal.stages() == {1: "uploaded", 2: "qced", 3: "pending"}
+        assert journal.completed("qced") == {1, 2}
+        assert journal.completed("uploaded") == {1}
+
+    def test_stage_is_never_moved_back(self, tmp_path):
+        journal = Journal(tmp_path / "journal.sqlite", "run")
+        journal.record("uploaded", casts[:1])
+        journal.record("pending", casts)
+        assert journal.stages()[1] == "uploaded"
+
+    def test_resume_from_existing_journal(self, tmp_path):
+        journal = Journal(tmp_path / "journal.sqlite", "run")
+        journal.record("uploaded", casts[:2])
+        journal.close()
+
+        assert Journal(tmp_path / "journal.sqlite", "run").completed("uploaded") == {
+            1,
+            2,
+        }
+        assert not Journal(tmp_path / "journal.sqlite", "other_run").completed(
+            "uploaded"
+        ), "Casts completed by a different run shouldn't be considered"
+
+    def test_failed_casts_are_retried(self, tmp_path):
+        journal = Journal(tmp_path / "journal.sqlite", "run")
+        journal.record("pending", casts)
+        journal.record("failed", casts[:2])
+        assert journal.stages() == {1: "failed", 2: "failed", 3: "pending"}
+        assert not journal.completed("fetched")
+        journal.record("qced", casts[:1])
+        journal.record("failed", casts[:1])
+        assert journal.stages()[1] == "qced"
+
+    def test_journal_chunk(self, tmp_path):
+        journal = Journal(tmp_path / "journal.sqlite", "run")
+        chunk = pd.DataFrame(casts, columns=["ctd_cast_pk", "hakai_id"])
+        _journal_chunk(
+            journal,
+            chunk.iloc[:2],
+            {"hakai_ids": ["a"], "stats": {"records_per_cast": {"a": 10}}},
+            upload_flag=True,
+        )
+        _journal_chunk(
+            journal, chunk.iloc[2:], {"hakai_ids": [], "stats": None}, upload_flag=True
+        )
+        assert journal.stages() == {1: "uploaded", 2: "fetched", 3: "failed"}
+
+    def test_hash_items(self):
+        assert hash_items({"a": 1, "b": 2}) == hash_items({"b": 2, "a": 1})
+        assert hash_items({"a": 1}) != hash_items({"a": 2})
@@ -0,0 +1,151 @@
+import time
+
+import pandas as pd
+import pytest
+
+import hakai_ctd_qc.__main__ as qc_main
+from hakai_ctd_qc import context as context_module
+from hakai_ctd_qc.context import QCContext
+
+HAKAI_IDS = ["a", "b", "fail", "c", "d", "e"]
+
+
+def _process_chunk_stub(chunk, **kwargs):
+    if "fail" in chunk["hakai_id"].values:
+        raise ValueError("Failed to qc chunk")
+    return dict(
+        hakai_ids=chunk["hakai_id"].tolist(),
+        stats=dict(records_per_cast={hakai_id: 1 for hakai_id in chunk["hakai_id"]}),
+    )
+
+
+def _casts(hakai_ids):
+    return pd.DataFrame(
+        {
+            "hakai_id": hakai_ids,
+            "ctd_cast_pk": range(len(hakai_ids)),
+            "processing_stage": "8_binAvg",
+        }
+    )
+
+
+def _chunks(hakai_ids, generated):
+    for hakai_id in hakai_ids:
+        generated.append(hakai_id)
+        yield _casts([hakai_id])
+
+
+@pytest.fixture
+def context(monkeypatch):
+    """Context with a stub station list, restoring the default context"""
+    monkeypatch.setattr(context_module, "_context", None)
+    context = QCContext()
+    context.stations = pd.DataFrame({"station": ["QU39"], "station_depth": [280.0]})
+    return context
+
+
+@pytest.fixture
+def run_main(monkeypatch, context):
+    monkeypatch.setattr(qc_main, "check_hakai_database_rebuild", lambda api_root: None)
+    monkeypatch.setattr(
+        qc_main, "get_hakai_data", lambda url, use_cache=True: _casts(HAKAI_IDS)
+    )
+
+    def _run_main(**kwargs):
+        return qc_main.main(chunksize=2, context=context, **kwargs)
+
+    return _run_main
+
+
+class TestProcessChunksPool:
+    def test_chunks_are_generated_lazily(self, monkeypatch, context):
+        monkeypatch.setattr(qc_main, "_process_chunk", _process_chunk_stub)
+        generated = []
+        results = {}
+        for chunk, result in qc_main._process_chunks_pool(
+            _chunks(HAKAI_IDS, generated), 2, context
+        ):
+            if not results:
+                assert len(generated) == 4, "Only 2 chunks per worker are queued"
+            results[chunk["hakai_id"].iloc[0]] = result["hakai_ids"]
+        assert generated == HAKAI_IDS
+        assert results == {
+            hakai_id: [] if hakai_id == "fail" else [hakai_id] for hakai_id in HAKAI_IDS
+        }
+
+    def test_processed_and_failed_hakai_ids(self, monkeypatch, run_main):
+        monkeypatch.setattr(qc_main, "_process_chunk", _process_chunk_stub)
+        result = run_main(workers=2)
+        assert result["hakai_ids"] == ["a", "b", "d", "e"]
+        assert result["failed_hakai_ids"] == ["fail", "c"]
+
+    def test_serial_processed_and_failed_hakai_ids(self, monkeypatch, run_main):
+        monkeypatch.setattr(qc_main, "_process_chunk", _process_chunk_stub)
+        result = run_main(workers=1)
+        assert result["hakai_ids"] == ["a", "b", "d", "e"]
+        assert result["failed_hakai_ids"] == ["fail", "c"]
+
+
+@pytest.fixture
+def pipeline_stubs(monkeypatch):
+    """Stub the pipeline stages, chunks named after a stage fail at it"""
+    uploads = []
+
+    def _fetch_chunk(chunk, api_root):
+        if "fetch_fail" in chunk["hakai_id"].values:
+            raise ConnectionError("Failed to fetch chunk")
+        return dict(chunk=chunk, data=chunk, metadata=None, manual_qc=None)
+
+    def _qc_chunk(chunk, data, metadata, manual_qc, **kwargs):
+        if "qc_fail" in chunk["hakai_id"].values:
+            raise ValueError("Failed to qc chunk")
+        return dict(chunk=chunk, data=data, stats=None)
+
+    def _upload_chunk(chunk, data, api_root, stats=None, **kwargs):
+        time.sleep(0.01)
+        uploads.append(chunk["hakai_id"].iloc[0])
+        if "upload_fail" in chunk["hakai_id"].values:
+            raise ConnectionError("Failed to upload chunk")
+        return dict(hakai_ids=chunk["hakai_id"].tolist(), stats=stats)
+
+    monkeypatch.setattr(qc_main, "_fetch_chunk", _fetch_chunk)
+    monkeypatch.setattr(qc_main, "_qc_chunk", _qc_chunk)
+    monkeypatch.setattr(qc_main, "_upload_chunk", _upload_chunk)
+    return uploads
+
+
+class TestProcessChunksPipeline:
+    hakai_ids = ["a", "fetch_fail", "b", "qc_fail", "c", "upload_fail", "d", "e"]
+
+    @pytest.mark.parametrize("max_chunks_in_memory", [1, 2, 3])
+    def test_chunks_order_and_backpressure(self, pipeline_stubs, max_chunks_in_memory):
+        generated, released, held = [], [], []
+
+        def _tracked_chunks():
+            for chunk in _chunks(self.hakai_ids, generated):
+                held.append(len(generated) - len(released))
+                yield chunk
+
+        for chunk, result in qc_main._process_chunks_pipeline(
+            _tracked_chunks(), max_chunks_in_memory, api_root="https://api"
+        ):
+            released.append((chunk["hakai_id"].iloc[0], result["hakai_ids"]))
+
+        assert max(held) <= max_chunks_in_memory
+        assert [hakai_id for hakai_id, _ in released] == self.hakai_ids
+        assert sorted(pipeline_stubs) == ["a", "b", "c", "d", "e", "upload_fail"]
+        assert dict(released) == {
+            hakai_id: [] if "fail" in hakai_id else [hakai_id]
+            for hakai_id in self.hakai_ids
+        }
+
+    def test_failed_hakai_ids(self, monkeypatch, pipeline_stubs, context):
+        monkeypatch.setattr(qc_main, "check_hakai_database_rebuild", lambda _: None)
+        monkeypatch.setattr(
+            qc_main,
+            "get_hakai_data",
+            lambda url, use_cache=True: _casts(self.hakai_ids),
+        )
+        result = qc_main.main(chunksize=1, pipeline_chunks=2, context=context)
+        assert result["hakai_ids"] == ["a", "b", "c", "d", "e"]
+        assert result["failed_hakai_ids"] == ["fetch_fail", "qc_fail", "upload_fail"]
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hakai_ctd_qc.predicates import Predicate, compile_predicate
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "x": [1.0, 4, None, 4, 2],
+            "y": [4, 4, 1, 2, 3],
+            "direction_flag": ["d", "u", "d", "d", None],
+            "par": [0.1, None, 0.3, 0.4, None],
+            "start_dt": pd.date_range("2020-01-01", periods=5, tz="UTC"),
+        }
+    )
+
+
+class TestPredicate:
+    @pytest.mark.parametrize(
+        "expression",
+        [
+            "x==4",
+            "x!=4",
+            "x==4 and direction_flag=='d'",
+            "x==4 & y!=4 & direction_flag=='d'",
+            "x>1 | y<2 & par.notna()",
+            "not x==4",
+            "~(x>2)",
+            "1<x<=4",
+            "direction_flag in ['d', 'u']",
+            "direction_flag not in ['d']",
+            "direction_flag==['u']",
+            "x+y>5",
+        ],
+    )
+    def test_matches_pandas_query(self, df, expression):
+        pd.testing.assert_frame_equal(
+            df.loc[compile_predicate(expression)(df)], df.query(expression)
+        )
+
+    def test_local_variables(self, df):
+        predicate = compile_predicate("start_dt>@minimum_date")
+        minimum_date = pd.Timestamp("2020-01-03", tz="UTC")
+        assert predicate.local_variables == {"minimum_date"}
+        assert predicate(df, minimum_date=minimum_date).tolist() == [
+            False,
+            False,
+            False,
+            True,
+            True,
+        ]
+        with pytest.raises(NameError):
+            predicate(df)
+
+    def test_columns(self):
+        predicate = compile_predicate(
+            "organization == 'A & B' & sensors_submerged=='Mid' & par.notna()"
+        )
+        assert predicate.columns == {"organization", "sensors_submerged", "par"}
+        assert predicate.missing_columns(["par", "organization"]) == {
+            "sensors_submerged"
+        }
+
+    def test_missing_columns(self, df):
+        with pytest.raises(KeyError):
+            compile_predicate("z==4")(df)
+
+    def test_invalid_expression(self):
+        with pytest.raises(ValueError):
+            Predicate("x==")
+
+    def test_compiled_once(self):
+        assert compile_predicate("x==4") is compile_predicate("x==4")
+
+    def test_empty_dataframe(self, df):
+        mask = compile_predicate("x==4")(df.iloc[:0])
+        assert mask.empty
+        assert mask.dtype == np.dtype(bool)
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+from ioos_qc import qartod
+
+from hakai_ctd_qc import qartod_batch
+from hakai_ctd_qc.__main__ import (
+    _derived_ocean_variables,
+    _run_ioosqc_on_dataframe,
+    _run_qartod_tests,
+    ioos_qc_coords_mapping,
+)
+from hakai_ctd_qc.context import QCContext
+
+
+def _as_arrays(df):
+    # ioos_qc results are stored as masked arrays
+    return pd.DataFrame({column: np.asarray(values) for column, values in df.items()})
+
+
+@pytest.fixture(scope="module")
+def df_profiles(df_initial):
+    df = _derived_ocean_variables(df_initial.reset_index())
+    df = df.query("direction_flag in ('d','u')")
+    return df.loc[df["hakai_id"].isin(df["hakai_id"].unique()[:20])]
+
+
+class TestQartodBatch:
+    def test_batch_flags_match_ioos_qc(self, df_profiles):
+        qartod_config = QCContext().qc_config.profile
+        by = ["hakai_id", "direction_flag"]
+        assert qartod_batch.is_supported(qartod_config.tests)
+        expected = _run_qartod_tests(df_profiles, qartod_config, by, "ioos_qc")
+        result = _run_qartod_tests(df_profiles, qartod_config, by, "batch")
+        pd.testing.assert_frame_equal(_as_arrays(result), _as_arrays(expected))
+
+    def test_unrecorded_streams_are_filled(self, df_profiles):
+        qartod_config = QCContext().qc_config.profile
+        by = ["hakai_id", "direction_flag"]
+        unrecorded = qartod_batch.unrecorded_streams(
+            df_profiles, qartod_config.tests, by
+        )
+        assert any("rinko_do_ml_l" in streams for streams in unrecorded.values())
+
+        expected = df_profiles.groupby(by, as_index=False, group_keys=True).apply(
+            lambda x: _run_ioosqc_on_dataframe(
+                x, qartod_config.ioos_config, **ioos_qc_coords_mapping
+            )
+        )
+        result = _run_qartod_tests(df_profiles, qartod_config, by, "ioos_qc")
+        pd.testing.assert_frame_equal(_as_arrays(result), _as_arrays(expected))
+
+    def test_static_measurements_match_ioos_qc(self, df_initial):
+        df = _derived_ocean_variables(df_initial.reset_index())
+        df = df.query("direction_flag in ('s')")
+        qartod_config = QCContext().qc_config.static
+        by = ["hakai_id", "measurement_dt"]
+        expected = _run_qartod_tests(df, qartod_config, by, "ioos_qc")
+        result = _run_qartod_tests(df, qartod_config, by, "batch")
+        pd.testing.assert_frame_equal(_as_arrays(result), _as_arrays(expected))
+
+    def test_flags_are_computed_within_segments(self):
+        inp = pd.Series([10.0, 10.0, 0.0, 0.0, 100.0])
+        tinp = pd.Series(pd.date_range("2024-01-01", periods=5, freq="s"))
+        starts = np.array([0, 2, 4])
+        assert qartod_batch.rate_of_change_test(inp, tinp, starts, 1).tolist() == [
+            1,
+            1,
+            1,
+            1,
+            1,
+        ]
+        assert qartod_batch.density_inversion_test(
+            inp, pd.Series([1.0, 2, 3, 4, 5]), starts, -0.03, -0.05
+        ).tolist() == [1, 1, 1, 1, 2]
+
+    @pytest.mark.parametrize("check_type", ["std", "range"])
+    def test_attenuated_signal_with_missing_values(self, check_type):
+        # Partially missing, fully missing and complete profiles
+        profiles = [
+            [np.nan, 10.0, np.nan, 12.0, 10.5, np.nan],
+            [np.nan, np.nan],
+            [10.0, 10.1, np.inf, 10.05],
+        ]
+        inp = pd.Series(np.concatenate(profiles))
+        tinp = pd.Series(pd.date_range("2024-01-01", periods=len(inp), freq="s"))
+        starts = np.cumsum([0] + [len(profile) for profile in profiles[:-1]])
+        expected = np.concatenate(
+            [
+                qartod.attenuated_signal_test(
+                    profile,
+                    tinp.iloc[start : start + len(profile)],
+                    1,
+                    0.1,
+                    check_type=check_type,
+                )
+                for start, profile in zip(starts, profiles)
+            ]
+        )
+        result = qartod_batch.attenuated_signal_test(
+            inp, tinp, starts, 1, 0.1, check_type=check_type
+        )
+        assert result.tolist() == expected.tolist()
+
+    def test_unsupported_configuration(self):
+        assert not qartod_batch.is_supported(
+            {"contexts": [{"streams": {"temp": {"qartod": {"spike_test": {}}}}}]}
+        )
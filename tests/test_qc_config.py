@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from hakai_ctd_qc.context import (
+    HAKAI_TESTS_CONFIGURATION_PATH,
+    QARTOD_TESTS_CONFIGURATION_PATH,
+)
+from hakai_ctd_qc.qc_config import compile_qc_config
+
+
+@pytest.fixture
+def configs():
+    return (
+        json.loads(QARTOD_TESTS_CONFIGURATION_PATH.read_text()),
+        json.loads(HAKAI_TESTS_CONFIGURATION_PATH.read_text()),
+    )
+
+
+def _qartod_tests(qartod_config):
+    return {
+        test
+        for context in qartod_config["contexts"]
+        for modules in context["streams"].values()
+        for test in modules["qartod"]
+    }
+
+
+class TestCompileQCConfig:
+    def test_configurations_are_not_modified(self, configs):
+        original = json.dumps(configs)
+        compile_qc_config(*configs)
+        assert json.dumps(configs) == original
+
+    def test_static_configuration(self, configs):
+        qc_config = compile_qc_config(*configs)
+        assert "attenuated_signal_test" in _qartod_tests(qc_config.profile.tests)
+        assert "attenuated_signal_test" not in _qartod_tests(qc_config.static.tests)
+
+    def test_compiled_configuration_is_immutable(self, configs):
+        qc_config = compile_qc_config(*configs)
+        with pytest.raises(TypeError):
+            qc_config.profile.tests["contexts"][0]["streams"]["temperature"] = {}
+        with pytest.raises(TypeError):
+            qc_config.hakai_tests["flag_aggregation"]["default"] += ("test",)
+
+    def test_flag_columns(self, configs):
+        qc_config = compile_qc_config(*configs)
+        assert "temperature" in qc_config.tested_variables
+        regex = qc_config.flag_columns["temperature"]
+        assert regex.search("temperature_qartod_gross_range_test")
+        assert regex.search("sigma0_qartod_density_inversion_test")
+        assert not regex.search("salinity_qartod_gross_range_test")
+
+    def test_drop_streams_is_compiled_once(self, configs):
+        profile = compile_qc_config(*configs).profile
+        dropped = profile.drop_streams({"par", "ph"})
+        assert dropped is profile.drop_streams(frozenset(["ph", "par"]))
+        assert profile.drop_streams(frozenset()) is profile
+        # Variants are cached by configuration rather than stored in it
+        assert (
+            compile_qc_config(*configs).profile.drop_streams({"par", "ph"}) is dropped
+        )
+        streams = {
+            stream
+            for context in dropped.tests["contexts"]
+            for stream in context["streams"]
+        }
+        assert "temperature" in streams
+        assert not streams & {"par", "ph"}
+
+    def test_invalid_configuration(self, configs):
+        qartod_config, hakai_tests_config = configs
+        with pytest.raises(ValueError):
+            compile_qc_config({"contexts": []}, hakai_tests_config)
+        with pytest.raises(ValueError):
+            compile_qc_config(qartod_config, {})
+        with pytest.raises(ValueError):
+            compile_qc_config(
+                {"contexts": [{"streams": {"temperature": {"qartod": {"nope": {}}}}}]},
+                hakai_tests_config,
+            )
+        with pytest.raises(ValueError):
+            compile_qc_config(
+                qartod_config,
+                {
+                    **hakai_tests_config,
+                    "query_based_flag": [
+                        {"query": "x==", "flag_columns": ["x_test"], "flag_value": 4}
+                    ],
+                },
+            )
@@ -0,0 +1,73 @@
+import gsw
+import numpy as np
+import pandas as pd
+import pytest
+
+from hakai_ctd_qc import teos10
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(42)
+    size = 1000
+    df = pd.DataFrame(
+        {
+            "salinity": rng.uniform(0, 35, size),
+            "temperature": rng.uniform(0, 20, size),
+            "pressure": rng.uniform(0, 300, size),
+            "station_longitude": rng.uniform(-130, -123, size),
+            "longitude": rng.uniform(-130, -123, size),
+            "station_latitude": rng.uniform(48, 54, size),
+            "latitude": rng.uniform(48, 54, size),
+        }
+    )
+    df.loc[::7, "station_longitude"] = np.nan
+    df.loc[::11, "station_latitude"] = np.nan
+    df.loc[::13, "salinity"] = np.nan
+    df.loc[::17, ["salinity", "temperature", "pressure"]] = -9.99e-29
+    return df
+
+
+def _serial_derived_variables(df):
+    def _drop_sbe_flag(x):
+        return x.replace(-9.99e-29, np.nan)
+
+    pressure = _drop_sbe_flag(df["pressure"])
+    absolute_salinity = gsw.SA_from_SP(
+        _drop_sbe_flag(df["salinity"]),
+        pressure,
+        df["station_longitude"].fillna(df["longitude"]),
+        df["station_latitude"].fillna(df["latitude"]),
+    )
+    conservative_temperature = gsw.CT_from_t(
+        absolute_salinity, _drop_sbe_flag(df["temperature"]), df["pressure"]
+    )
+    return {
+        "absolute salinity": absolute_salinity,
+        "conservative temperature": conservative_temperature,
+        "density": gsw.rho(absolute_salinity, conservative_temperature, pressure),
+        "sigma0": gsw.sigma0(absolute_salinity, conservative_temperature),
+    }
+
+
+class TestDerivedOceanVariables:
+    @pytest.mark.parametrize(
+        "threads,block_size", [(1, teos10.BLOCK_SIZE), (1, 64), (4, 64), (3, 999)]
+    )
+    def test_blocks_match_serial_computation(self, df, threads, block_size):
+        expected = _serial_derived_variables(df)
+        result = teos10.derived_ocean_variables(
+            df, threads=threads, block_size=block_size
+        )
+        assert tuple(result) == teos10.DERIVED_VARIABLES
+        for variable, values in result.items():
+            np.testing.assert_array_equal(values, expected[variable].to_numpy())
+
+    def test_inputs_are_not_modified(self, df):
+        original = df.copy()
+        teos10.derived_ocean_variables(df, threads=2, block_size=100)
+        pd.testing.assert_frame_equal(df, original)
+
+    def test_empty(self, df):
+        result = teos10.derived_ocean_variables(df.iloc[:0])
+        assert all(values.shape == (0,) for values in result.values())
@@ -1,6 +1,10 @@
+import asyncio
 import re
 
+from loguru import logger
+
 from hakai_ctd_qc import variables
+from hakai_ctd_qc.utils import async_retry
 
 hakai_id_regex = r"\d+_\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z"
 
@@ -19,3 +23,26 @@ class TestLoadTestSuite:
             "Some items listed in the hakai_id test suite aren't "
             f"matching the expected hakai_id patter={hakai_id_regex}"
         )
+
+
+class TestAsyncRetry:
+    def test_failed_attempts_are_logged(self):
+        calls = []
+
+        @async_retry(attempts=3, delay=0)
+        async def flaky():
+            calls.append(None)
+            if len(calls) < 3:
+                raise ValueError("server error")
+            return "ok"
+
+        messages = []
+        sink = logger.add(messages.append, level="WARNING", format="{message}")
+        try:
+            assert asyncio.run(flaky()) == "ok"
+        finally:
+            logger.remove(sink)
+        assert [message.strip() for message in messages] == [
+            "Attempt 1/3 of flaky failed with error: server error",
+            "Attempt 2/3 of flaky failed with error: server error",
+        ]